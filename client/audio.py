@@ -0,0 +1,280 @@
+"""
+Audio pipeline - one capture thread feeding wake word detection and command recording
+Frames go into a PCM ring buffer, so the command is recorded from the very frame the
+wake word ended at, without reopening the audio device. The background noise level is
+tracked continuously instead of calibrating before every command.
+
+Try it on a recording (16 kHz mono 16-bit WAV) to see which phrases it picks up:
+
+    python3 audio.py --wav command.wav
+"""
+
+import argparse
+import collections
+import threading
+import time
+import wave
+import numpy as np
+import config
+
+
+class MicrophoneSource:
+    """Default input device through PyAudio, read in blocking frame_length chunks"""
+
+    def __init__(self, sample_rate, frame_length):
+        import pyaudio
+        self.sample_rate = sample_rate
+        self.frame_length = frame_length
+        self._pa = pyaudio.PyAudio()
+        self._stream = self._pa.open(
+            rate=sample_rate,
+            channels=1,
+            format=pyaudio.paInt16,
+            input=True,
+            frames_per_buffer=frame_length
+        )
+
+    def read(self):
+        # Blocks until a full frame was captured, never drop frames on overflow
+        data = self._stream.read(self.frame_length, exception_on_overflow=False)
+        return np.frombuffer(data, dtype=np.int16)
+
+    def close(self):
+        self._stream.close()
+        self._pa.terminate()
+
+
+class WavFileSource:
+    """Plays a 16-bit mono WAV file frame by frame, paced like a microphone unless realtime=False"""
+
+    def __init__(self, path, sample_rate, frame_length, realtime=True):
+        self._wav = wave.open(path, 'rb')
+        if self._wav.getnchannels() != 1 or self._wav.getsampwidth() != 2:
+            raise ValueError(f"{path} must be 16-bit mono")
+        if self._wav.getframerate() != sample_rate:
+            raise ValueError(f"{path} is {self._wav.getframerate()} Hz, expected {sample_rate} Hz")
+        self.sample_rate = sample_rate
+        self.frame_length = frame_length
+        self.realtime = realtime
+        self._next_frame = time.time()
+
+    def read(self):
+        """Next frame, None once the file is exhausted"""
+        data = self._wav.readframes(self.frame_length)
+        if len(data) < self.frame_length * 2:
+            return None
+        if self.realtime:
+            delay = self._next_frame - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_frame += self.frame_length / self.sample_rate
+        return np.frombuffer(data, dtype=np.int16)
+
+    def close(self):
+        self._wav.close()
+
+
+def open_source(source, sample_rate, frame_length):
+    """Open "microphone" or the path of a WAV file as an audio source"""
+    if source == "microphone":
+        return MicrophoneSource(sample_rate, frame_length)
+    return WavFileSource(source, sample_rate, frame_length)
+
+
+class AudioPipeline:
+    """Captures audio frames on a background thread into a ring buffer
+
+    Every frame is passed to the wake word detector (a callable taking the int16
+    frame and returning True on detection) and its RMS level is stored next to
+    it. While no command is being recorded the level also updates the noise
+    floor, from which the speech threshold is derived.
+    """
+
+    def __init__(self, source, wake_detector=None, buffer_seconds=10):
+        self.source = source
+        self.sample_rate = source.sample_rate
+        self.frame_length = source.frame_length
+        self.wake_detector = wake_detector
+        self.noise_level = None
+        self.finished = False
+        ring_frames = int(buffer_seconds * self.sample_rate / self.frame_length)
+        self._ring = np.zeros((ring_frames, self.frame_length), dtype=np.int16)
+        self._levels = np.zeros(ring_frames, dtype=np.float32)
+        self._times = np.zeros(ring_frames, dtype=np.float64)   # time.time() each frame was captured
+        self._frames = 0    # frames captured since start, frame n lives in slot n % ring_frames
+        self._wake_frames = collections.deque()     # frame numbers right after each detected wake word
+        self._recording = 0     # phrases being recorded, the noise floor is frozen meanwhile
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    @property
+    def energy_threshold(self):
+        """RMS level above which a frame counts as speech"""
+        if self.noise_level is None:
+            return config.MIN_ENERGY_THRESHOLD
+        return max(config.MIN_ENERGY_THRESHOLD, self.noise_level * config.NOISE_MULTIPLIER)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=1)
+        self.source.close()
+
+    def _update_noise_level(self, level):
+        """Follow the background noise: quickly when it gets quieter, slowly (and not on speech) when louder"""
+        if self.noise_level is None:
+            self.noise_level = level
+        elif level < self.noise_level:
+            self.noise_level += 0.1 * (level - self.noise_level)
+        elif level < self.energy_threshold:
+            self.noise_level += 0.01 * (level - self.noise_level)
+
+    def _run(self):
+        while self._running:
+            pcm = self.source.read()
+            captured = time.time()
+            if pcm is None:
+                break
+
+            level = float(np.sqrt(np.mean(pcm.astype(np.float32) ** 2)))
+            detected = self.wake_detector is not None and self.wake_detector(pcm)
+
+            with self._cond:
+                if not self._recording:
+                    self._update_noise_level(level)
+                slot = self._frames % len(self._ring)
+                self._ring[slot] = pcm
+                self._levels[slot] = level
+                self._times[slot] = captured
+                self._frames += 1
+                if detected:
+                    self._wake_frames.append(self._frames)
+                self._cond.notify_all()
+
+        with self._cond:
+            self.finished = True
+            self._cond.notify_all()
+
+    def wait_for_wake_word(self):
+        """Block until the wake word is heard, return the frame number right after it
+
+        Returns None once the source is exhausted or the pipeline was stopped.
+        """
+        with self._cond:
+            while not self._wake_frames and self._running and not self.finished:
+                self._cond.wait()
+            return self._wake_frames.popleft() if self._wake_frames else None
+
+    def frame_time(self, frame):
+        """time.time() at which a frame was captured, now if it is no longer (or not yet) buffered"""
+        with self._cond:
+            if self._frames - len(self._ring) <= frame < self._frames:
+                return float(self._times[frame % len(self._ring)])
+        return time.time()
+
+    @property
+    def frame_count(self):
+        with self._cond:
+            return self._frames
+
+    def _wait_frame(self, frame):
+        """Block until `frame` was captured and return its level, None if it never will be"""
+        with self._cond:
+            while self._frames <= frame and self._running and not self.finished:
+                self._cond.wait()
+            if self._frames <= frame:
+                return None
+            return float(self._levels[frame % len(self._ring)])
+
+    def read(self, start, end):
+        """PCM bytes of frames [start, end), clipped to what the ring buffer still holds"""
+        with self._cond:
+            start = max(start, self._frames - len(self._ring))
+            slots = [frame % len(self._ring) for frame in range(start, min(end, self._frames))]
+            return self._ring[slots].tobytes()
+
+    def record_phrase(self, start, timeout, phrase_time_limit, pause_threshold, pre_roll=0.3):
+        """Record the first phrase spoken from frame `start` on
+
+        Args:
+            start (int): Frame number to start listening at, e.g. from wait_for_wake_word()
+            timeout (float): Seconds to wait for speech to begin
+            phrase_time_limit (float): Maximum phrase length in seconds
+            pause_threshold (float): Seconds of silence that end the phrase
+            pre_roll (float): Seconds kept before the first loud frame, so soft onsets aren't cut
+
+        Returns:
+            tuple: (PCM bytes, frame number after the phrase), or (None, frame) if nothing was said
+        """
+        seconds = self.sample_rate / self.frame_length     # frames per second
+        frame = start
+        speech_start = last_speech = None
+        try:
+            while True:
+                with self._cond:
+                    # Fell behind the ring buffer, continue with the oldest frame still held
+                    frame = max(frame, self._frames - len(self._ring))
+                level = self._wait_frame(frame)
+                if level is None:
+                    break
+
+                if speech_start is None:
+                    if level > self.energy_threshold:
+                        # Freeze the noise floor and threshold so the phrase itself doesn't raise them
+                        with self._cond:
+                            self._recording += 1
+                            threshold = self.energy_threshold
+                        speech_start = max(start, frame - int(pre_roll * seconds))
+                        last_speech = frame
+                    elif frame - start >= timeout * seconds:
+                        return None, frame
+                else:
+                    if level > threshold:
+                        last_speech = frame
+                    if frame - last_speech >= pause_threshold * seconds or frame - speech_start >= phrase_time_limit * seconds:
+                        break
+                frame += 1
+        finally:
+            if speech_start is not None:
+                with self._cond:
+                    self._recording -= 1
+
+        if speech_start is None:
+            return None, frame
+        return self.read(speech_start, frame + 1), frame + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the audio pipeline on a WAV file and print the phrases it hears")
+    parser.add_argument("--wav", required=True, help="16-bit mono WAV at SAMPLE_RATE")
+    args = parser.parse_args()
+
+    source = WavFileSource(args.wav, config.SAMPLE_RATE, config.CHUNK_SIZE, realtime=False)
+    pipeline = AudioPipeline(source, buffer_seconds=config.AUDIO_BUFFER_SECONDS)
+    pipeline.start()
+
+    frame = 0
+    frame_seconds = config.CHUNK_SIZE / config.SAMPLE_RATE
+    while True:
+        pcm, end = pipeline.record_phrase(frame, config.COMMAND_TIMEOUT, config.PHRASE_TIME_LIMIT,
+                                          config.PAUSE_THRESHOLD)
+        if pcm is None and pipeline.finished and end >= pipeline.frame_count:
+            break
+        if pcm is not None:
+            duration = len(pcm) / 2 / config.SAMPLE_RATE
+            print(f"Phrase ending at {end * frame_seconds:.2f}s, {duration:.2f}s long "
+                  f"(noise level {pipeline.noise_level:.0f}, threshold {pipeline.energy_threshold:.0f})")
+        frame = end
+    pipeline.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Command recognizer benchmark - accuracy and latency of each backend on recorded WAV fixtures
+Fixtures are 16 kHz mono WAV files sorted by the word they contain:
+
+    fixtures/on/*.wav
+    fixtures/off/*.wav
+
+Usage:
+    cd client && python3 benchmark_commands.py --fixtures fixtures --recognizers google,template,vosk
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+import numpy as np
+from command_recognizers import create_recognizer, read_wav
+
+
+def load_fixtures(fixtures_dir):
+    """(expected word, path, PCM bytes, sample rate) of every fixture"""
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, "*", "*.wav"))):
+        samples, sample_rate = read_wav(path)
+        fixtures.append((os.path.basename(os.path.dirname(path)).lower(), path, samples.tobytes(), sample_rate))
+    return fixtures
+
+
+def bench_recognizer(name, fixtures):
+    """Run one recognizer over every fixture"""
+    try:
+        recognizer = create_recognizer(name)
+    except Exception as e:
+        return {"recognizer": name, "error": f"Could not create recognizer: {e}"}
+
+    timings = []
+    correct = 0
+    errors = 0
+    mistakes = []
+    for expected, path, pcm, sample_rate in fixtures:
+        start = time.perf_counter()
+        try:
+            text = recognizer.recognize(pcm, sample_rate)
+        except Exception as e:
+            text = None
+            errors += 1
+            print(f"{name}: {path} failed: {e}")
+        timings.append(time.perf_counter() - start)
+
+        if expected in (text or "").split():
+            correct += 1
+        else:
+            mistakes.append({"file": path, "expected": expected, "heard": text})
+
+    timings_ms = np.asarray(timings) * 1000
+    return {
+        "recognizer": name,
+        "fixtures": len(fixtures),
+        "accuracy": correct / len(fixtures),
+        "errors": errors,
+        "p50_ms": float(np.percentile(timings_ms, 50)),
+        "p90_ms": float(np.percentile(timings_ms, 90)),
+        "max_ms": float(timings_ms.max()),
+        "mistakes": mistakes
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VisualAssistant command recognizer benchmark")
+    parser.add_argument("--fixtures", required=True, help="directory with <word>/*.wav recordings")
+    parser.add_argument("--recognizers", default="google,vosk,template")
+    parser.add_argument("--output", default="command_benchmark.json")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        parser.error(f"No fixtures found in {args.fixtures}/<word>/*.wav")
+
+    results = [bench_recognizer(name, fixtures) for name in args.recognizers.split(",") if name]
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    for result in results:
+        if "error" in result:
+            print(f"{result['recognizer']:>10}: {result['error']}")
+        else:
+            print(f"{result['recognizer']:>10}: accuracy {result['accuracy']:.0%}, "
+                  f"p50 {result['p50_ms']:.0f}ms, p90 {result['p90_ms']:.0f}ms, errors {result['errors']}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Camera capture - a background thread keeping a ring buffer of timestamped, pre-encoded frames
+Works with a camera, a video file or synthetic frames, so it can be tried without hardware:
+
+    python3 camera.py --source synthetic
+    python3 camera.py --source recording.mp4
+"""
+
+import argparse
+import bisect
+import collections
+import threading
+import time
+import cv2
+import numpy as np
+import config
+
+
+def encode_frame(frame):
+    """JPEG-encode a camera frame for upload, downscaled first if an upload size is set"""
+    if config.UPLOAD_IMAGE_SIZE is not None:
+        frame = cv2.resize(frame, config.UPLOAD_IMAGE_SIZE, interpolation=cv2.INTER_AREA)
+    ok, img_encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, config.UPLOAD_JPEG_QUALITY])
+    return img_encoded.tobytes() if ok else None
+
+
+class VideoFileSource:
+    """Plays a video file in a loop at its own frame rate, like a camera would deliver it"""
+
+    def __init__(self, path):
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise ValueError(f"Could not open video file {path}")
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.frame_interval = 1.0 / fps if fps and fps > 0 else 1.0 / 30
+        self._next_frame = time.time()
+
+    def read(self):
+        delay = self._next_frame - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_frame = max(self._next_frame, time.time() - self.frame_interval) + self.frame_interval
+
+        ret, frame = self.capture.read()
+        if not ret:
+            # End of file, start over
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.capture.read()
+        return ret, frame
+
+    def release(self):
+        self.capture.release()
+
+
+class SyntheticSource:
+    """Generates frames of a colored square moving across a gray background, for testing"""
+
+    def __init__(self, width=640, height=480, fps=30):
+        self.width = width
+        self.height = height
+        self.frame_interval = 1.0 / fps
+        self.frame_number = 0
+        self._next_frame = time.time()
+
+    def read(self):
+        delay = self._next_frame - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_frame = max(self._next_frame, time.time() - self.frame_interval) + self.frame_interval
+
+        frame = np.full((self.height, self.width, 3), 128, dtype=np.uint8)
+        x = (self.frame_number * 8) % (self.width - 100)
+        cv2.rectangle(frame, (x, 190), (x + 100, 290), (0, 0, 255), -1)
+        self.frame_number += 1
+        return True, frame
+
+    def release(self):
+        pass
+
+
+def open_source(source):
+    """Open a camera index, a video file path or "synthetic" as a frame source"""
+    if source == "synthetic":
+        return SyntheticSource(config.IMAGE_WIDTH, config.IMAGE_HEIGHT)
+    if isinstance(source, int) or str(source).isdigit():
+        return cv2.VideoCapture(int(source))
+    return VideoFileSource(source)
+
+
+class FrameBuffer:
+    """Captures frames on a background thread into a ring buffer of (timestamp, JPEG bytes)
+
+    Reading continuously also drains the camera driver's buffer, so frames are
+    current instead of queued seconds ago. Every `interval` seconds the newest
+    frame is downscaled, encoded and kept; the oldest fall out once `size` are
+    buffered. Callers pick the frame(s) closest to the moment they care about,
+    e.g. when the wake word was heard.
+    """
+
+    def __init__(self, source, size, interval):
+        self.source = source
+        self.interval = interval
+        self.source_lock = threading.Lock()     # VideoCapture is not thread-safe
+        self._frames = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=1)
+
+    def _run(self):
+        last_encoded = 0
+        while self._running:
+            with self.source_lock:
+                ret, frame = self.source.read()
+            if not ret:
+                time.sleep(0.05)
+                continue
+
+            # Timestamp right after the read, encoding time doesn't count
+            now = time.time()
+            if now - last_encoded < self.interval:
+                continue
+
+            jpeg = encode_frame(frame)
+            if jpeg is not None:
+                with self._lock:
+                    self._frames.append((now, jpeg))
+                last_encoded = now
+
+    def snapshot(self):
+        """Copy of the buffered (timestamp, JPEG bytes) entries, oldest first"""
+        with self._lock:
+            return list(self._frames)
+
+    def latest(self, max_age):
+        """JPEG bytes of the newest frame, or None if there is none younger than max_age seconds"""
+        with self._lock:
+            if not self._frames or time.time() - self._frames[-1][0] > max_age:
+                return None
+            return self._frames[-1][1]
+
+    def since(self, timestamp):
+        """(timestamp, JPEG bytes) entries captured after `timestamp`, oldest first"""
+        with self._lock:
+            return [entry for entry in self._frames if entry[0] > timestamp]
+
+    def around(self, moment, count=1, max_distance=None):
+        """JPEG bytes of the `count` frames captured closest to `moment` (a time.time() value)
+
+        Frames farther than max_distance seconds from the moment are left out,
+        the result is in capture order and may be empty.
+        """
+        frames = self.snapshot()
+        if not frames:
+            return []
+        timestamps = [timestamp for timestamp, _ in frames]
+
+        # Grow a window outwards from the frame nearest to the moment
+        nearest = bisect.bisect_left(timestamps, moment)
+        lo, hi = nearest, nearest
+        while hi - lo < count and (lo > 0 or hi < len(frames)):
+            before = moment - timestamps[lo - 1] if lo > 0 else float("inf")
+            after = timestamps[hi] - moment if hi < len(frames) else float("inf")
+            if before <= after:
+                lo -= 1
+            else:
+                hi += 1
+
+        return [jpeg for timestamp, jpeg in frames[lo:hi]
+                if max_distance is None or abs(timestamp - moment) <= max_distance]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Try the capture thread without the rest of the client")
+    parser.add_argument("--source", default=str(config.CAMERA_SOURCE),
+                        help='camera index, video file path or "synthetic"')
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    source = open_source(args.source)
+    frames = FrameBuffer(source, config.FRAME_BUFFER_SIZE, config.PREENCODE_INTERVAL)
+    frames.start()
+    time.sleep(args.seconds)
+    moment = time.time() - args.seconds / 2
+    picked = frames.around(moment, count=3)
+    frames.stop()
+    source.release()
+
+    buffered = frames.snapshot()
+    print(f"Buffered {len(buffered)} frames, {sum(len(jpeg) for _, jpeg in buffered) / max(len(buffered), 1):.0f} bytes each")
+    if len(buffered) > 1:
+        print(f"Spacing: {(buffered[-1][0] - buffered[0][0]) / (len(buffered) - 1) * 1000:.0f}ms")
+    print(f"Picked {len(picked)} frames around {args.seconds / 2:.1f}s ago")
+
+
+if __name__ == "__main__":
+    main()
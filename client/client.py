@@ -1,13 +1,17 @@
-import pyaudio
-import struct
 import pvporcupine
-import speech_recognition as sr
 import cv2
 import requests
 import io
+import socket
+import statistics
 import time
+from requests.adapters import HTTPAdapter
 from PIL import Image
 import config
+from audio import AudioPipeline, open_source as open_audio_source
+from camera import FrameBuffer, encode_frame, open_source
+from command_recognizers import create_recognizer
+from streaming import CommandSession
 
 # Global Porcupine setup (like in max_voice.py)
 print("Setting up Porcupine...")
@@ -19,33 +23,42 @@ try:
         keyword_paths=keyword_paths
     )
     print("Porcupine created successfully!")
-    
-    pa = pyaudio.PyAudio()
-    audio_stream = pa.open(
-        rate=porcupine_handle.sample_rate,
-        channels=1,
-        format=pyaudio.paInt16,
-        input=True,
-        frames_per_buffer=porcupine_handle.frame_length
-    )
-    print("Audio stream opened successfully!")
     print(f"Sample rate: {porcupine_handle.sample_rate}, Frame length: {porcupine_handle.frame_length}")
     
 except Exception as e:
     print(f"Error setting up Porcupine: {e}")
     porcupine_handle = None
-    audio_stream = None
-    pa = None
 
 class VisualAssistantClient:
     def __init__(self):
-        self.recognizer = sr.Recognizer()
-        self.microphone = sr.Microphone()
-        self.camera = cv2.VideoCapture(config.CAMERA_INDEX)
+        # Google (cloud) or an offline small-vocabulary recognizer, see command_recognizers.py
+        self.recognizer = create_recognizer(config.COMMAND_RECOGNIZER)
+        self.camera = open_source(config.CAMERA_SOURCE)
+        
+        # One audio thread feeds wake word detection and command capture from a shared ring buffer
+        sample_rate = porcupine_handle.sample_rate if porcupine_handle else config.SAMPLE_RATE
+        frame_length = porcupine_handle.frame_length if porcupine_handle else config.CHUNK_SIZE
+        wake_detector = (lambda pcm: porcupine_handle.process(pcm) >= 0) if porcupine_handle else None
+        self.audio = AudioPipeline(open_audio_source(config.AUDIO_SOURCE, sample_rate, frame_length),
+                                   wake_detector, config.AUDIO_BUFFER_SECONDS)
+        
+        # Keep-alive connection to the server, reused by every command
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.headers["X-Client-Id"] = config.CLIENT_ID or socket.gethostname()
+        
+        # Capture and encode frames ahead of time, so the frame matching the moment the
+        # command was given is already buffered and the upload can start right away
+        self.frames = FrameBuffer(self.camera, config.FRAME_BUFFER_SIZE, config.PREENCODE_INTERVAL)
+        self.frames.start()
+        
+        # End-of-speech to server response of every command, in milliseconds
+        self.latencies = []
         
     def capture_image(self):
         """Capture image from camera"""
-        ret, frame = self.camera.read()
+        with self.frames.source_lock:
+            ret, frame = self.camera.read()
         if ret:
             # Resize image for faster processing
             frame = cv2.resize(frame, (config.IMAGE_WIDTH, config.IMAGE_HEIGHT))
@@ -53,49 +66,42 @@ class VisualAssistantClient:
         return None
     
     def listen_for_wake_word(self):
-        """Listen for wake word using Porcupine (exactly like max_voice.py)"""
-        global porcupine_handle, audio_stream
+        """Block until Porcupine hears the wake word, return the audio frame right after it (None when input ends)"""
+        if not porcupine_handle:
+            print("Wake word detection is not available, check the Porcupine setup")
         
-        if not porcupine_handle or not audio_stream:
-            return False
-            
-        try:
-            # Exact same pattern as max_voice.py
-            pcm = audio_stream.read(porcupine_handle.frame_length)
-            pcm = struct.unpack_from("h" * porcupine_handle.frame_length, pcm)
-            
-            keyword_index = porcupine_handle.process(pcm)
-            if keyword_index >= 0:
-                print("Wake word detected!")
-                print("Say 'on' or 'off' now...")
-                return True
-                
-        except Exception as e:
-            print(f"Error in wake word detection: {e}")
-            
-        return False
+        wake_frame = self.audio.wait_for_wake_word()
+        if wake_frame is not None:
+            print("Wake word detected!")
+            print("Say 'on' or 'off' now...")
+        return wake_frame
     
-    def listen_for_command(self, timeout=5):
-        """Listen for voice command after wake word"""
+    def listen_for_command(self, start_frame, timeout=config.COMMAND_TIMEOUT):
+        """Recognize the command spoken after the wake word, from the shared audio buffer
+        
+        Returns:
+            tuple: (command text or None, audio frame number where the command ended)
+        """
+        end_frame = start_frame
         try:
             print("Listening for command...")
-            with self.microphone as source:
-                self.recognizer.adjust_for_ambient_noise(source, duration=0.5)
-                audio = self.recognizer.listen(source, timeout=timeout)
+            pcm, end_frame = self.audio.record_phrase(start_frame, timeout, config.PHRASE_TIME_LIMIT,
+                                                      config.PAUSE_THRESHOLD)
+            if pcm is None:
+                print("No command heard within timeout")
+                return None, end_frame
+            
+            command = self.recognizer.recognize(pcm, self.audio.sample_rate)
+            if command is None:
+                print("Could not understand the command")
+                return None, end_frame
             
-            command = self.recognizer.recognize_google(audio).lower()
             print(f"Command heard: {command}")
-            return command
+            return command, end_frame
             
-        except sr.WaitTimeoutError:
-            print("No command heard within timeout")
-            return None
-        except sr.UnknownValueError:
-            print("Could not understand the command")
-            return None
         except Exception as e:
             print(f"Error in speech recognition: {e}")
-            return None
+            return None, end_frame
     
     def parse_command(self, command):
         """Parse command to extract action - just look for 'on' or 'off'"""
@@ -112,18 +118,34 @@ class VisualAssistantClient:
             
         return None
     
-    def send_to_server(self, image, device, action):
-        """Send image and command to server"""
+    def command_images(self, moment):
+        """JPEG bytes of the buffered frames closest to `moment`, or a fresh frame if none are
+        
+        Returns:
+            list: FRAMES_PER_COMMAND encoded frames (fewer if the buffer is short), empty on failure
+        """
+        images = self.frames.around(moment, config.FRAMES_PER_COMMAND, max_distance=config.MAX_FRAME_AGE)
+        if images:
+            return images
+        
+        # Capture thread is stalled or not running, grab and encode a frame now
+        image = self.capture_image()
+        img_bytes = encode_frame(image) if image is not None else None
+        return [img_bytes] if img_bytes is not None else []
+    
+    def send_to_server(self, images, device, action):
+        """Send JPEG image bytes and command to server, several frames are voted on by the server"""
         try:
-            # Convert image to bytes
-            _, img_encoded = cv2.imencode('.jpg', image)
-            img_bytes = img_encoded.tobytes()
-            
-            files = {'image': ('image.jpg', img_bytes, 'image/jpeg')}
-            data = {'device': device, 'action': action}
+            data = {'device': device, 'action': action, 'sync': '1' if config.WAIT_FOR_ACTUATION else '0'}
+            if len(images) == 1:
+                endpoint = config.API_ENDPOINT
+                files = {'image': ('image.jpg', images[0], 'image/jpeg')}
+            else:
+                endpoint = config.BATCH_ENDPOINT
+                files = [('images', (f'frame_{i}.jpg', img_bytes, 'image/jpeg')) for i, img_bytes in enumerate(images)]
             
-            print(f"Sending to server: {device} -> {action}")
-            response = requests.post(config.API_ENDPOINT, files=files, data=data, timeout=10)
+            print(f"Sending to server: {device} -> {action} ({len(images)} frames)")
+            response = self.session.post(endpoint, files=files, data=data, timeout=config.REQUEST_TIMEOUT)
             
             if response.status_code == 200:
                 result = response.json()
@@ -137,47 +159,75 @@ class VisualAssistantClient:
             print(f"Error sending to server: {e}")
             return False
     
+    def report_latency(self, speech_end):
+        """Print the time from the end of the spoken command to the server's answer"""
+        latency = (time.time() - speech_end) * 1000
+        self.latencies.append(latency)
+        actuation = "actuation" if config.WAIT_FOR_ACTUATION else "command queued"
+        print(f"End of speech to {actuation}: {latency:.0f}ms "
+              f"(median {statistics.median(self.latencies):.0f}ms over {len(self.latencies)} commands)")
+    
     def run(self):
         """Main client loop"""
         print("VisualAssistant Client Started!")
         print("Say 'Hey Max' followed by 'on' or 'off'")
         print("Listening...")
         
+        self.audio.start()
         try:
             while True:
-                # Listen for wake word
-                if self.listen_for_wake_word():
-                    time.sleep(0.2)  # Brief pause after wake word
-                    
-                    # Listen for command
-                    command = self.listen_for_command()
-                    action = self.parse_command(command)
+                # Listen for wake word, blocks on the audio thread instead of polling
+                wake_frame = self.listen_for_wake_word()
+                if wake_frame is None:
+                    print("Audio input ended")
+                    break
+                
+                # Upload frames from the wake word on, the server recognizes them while we transcribe
+                streaming = None
+                if config.STREAMING:
+                    streaming = CommandSession(self.session, self.frames, self.audio.frame_time(wake_frame)).start()
+                
+                # Listen for command, recorded from the frame right after the wake word
+                command, end_frame = self.listen_for_command(wake_frame)
+                action = self.parse_command(command)
+                speech_end = self.audio.frame_time(end_frame - 1)
+                
+                if action:
+                    result = streaming.finish("visual_target", action) if streaming else None
+                    if result is not None:
+                        print(f"Server response: {result.get('message', 'Success')} "
+                              f"({result.get('frame_count', 0)} frames, recognized "
+                              f"{result.get('recognition_head_start_ms', 0):.0f}ms before the action arrived)")
+                        if result.get("success"):
+                            self.report_latency(speech_end)
+                        continue
                     
-                    if action:
-                        # Capture image
-                        image = self.capture_image()
-                        if image is not None:
-                            # Send to server - device will be recognized from image
-                            self.send_to_server(image, "visual_target", action)
-                        else:
-                            print("Failed to capture image")
+                    # Frames are already downscaled and encoded, pick the ones from when the words were spoken
+                    moment_frame = wake_frame if config.FRAME_MOMENT == "wake" else end_frame
+                    moment = self.audio.frame_time(moment_frame)
+                    images = self.command_images(moment)
+                    if images:
+                        # Send to server - device will be recognized from image
+                        if self.send_to_server(images, "visual_target", action):
+                            self.report_latency(speech_end)
                     else:
-                        print("Could not parse command. Try: 'on' or 'off'")
-
-                time.sleep(0.1)  # Small delay to prevent excessive CPU usage. Don't freeze my laptop :/
+                        print("Failed to capture image")
+                else:
+                    if streaming:
+                        streaming.cancel()
+                    print("Could not parse command. Try: 'on' or 'off'")
                 
         except KeyboardInterrupt:
             print("\nShutting down...")
-            self.cleanup()
+        self.cleanup()
     
     def cleanup(self):
         """Clean up resources"""
-        global audio_stream, pa, porcupine_handle
+        global porcupine_handle
         
-        if audio_stream:
-            audio_stream.close()
-        if pa:
-            pa.terminate()
+        self.audio.stop()
+        self.frames.stop()
+        self.session.close()
         if porcupine_handle:
             porcupine_handle.delete()
         if self.camera:
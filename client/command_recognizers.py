@@ -0,0 +1,157 @@
+"""
+Command recognizers - turn the recorded command (16-bit mono PCM) into text
+Select one with COMMAND_RECOGNIZER in config.py:
+
+    google    Google Web Speech API through speech_recognition (needs the network)
+    vosk      Offline Kaldi decoding constrained to COMMAND_VOCABULARY (pip install vosk + a model)
+    template  Offline MFCC + dynamic time warping against your own recordings of each word
+
+Template recordings go in COMMAND_TEMPLATES_DIR/<word>/*.wav (16 kHz mono, a few per word).
+"""
+
+import glob
+import json
+import os
+import wave
+import numpy as np
+import config
+
+
+class GoogleRecognizer:
+    """Free Google Web Speech API, the original cloud recognizer"""
+
+    name = "google"
+
+    def __init__(self):
+        import speech_recognition as sr
+        self._sr = sr
+        self._recognizer = sr.Recognizer()
+
+    def recognize(self, pcm, sample_rate):
+        """Text of the command, None if nothing was understood"""
+        audio = self._sr.AudioData(pcm, sample_rate, 2)
+        try:
+            return self._recognizer.recognize_google(audio).lower()
+        except self._sr.UnknownValueError:
+            return None
+
+
+class VoskRecognizer:
+    """Offline Kaldi recognizer whose grammar only allows the command vocabulary"""
+
+    name = "vosk"
+
+    def __init__(self):
+        try:
+            import vosk
+        except ImportError:
+            raise ImportError("The vosk recognizer needs 'pip install vosk' and a model in VOSK_MODEL_PATH")
+        vosk.SetLogLevel(-1)
+        self._vosk = vosk
+        self._model = vosk.Model(config.VOSK_MODEL_PATH)
+        # "[unk]" lets anything outside the vocabulary decode as unknown instead of the closest word
+        self._grammar = json.dumps(config.COMMAND_VOCABULARY + ["[unk]"])
+
+    def recognize(self, pcm, sample_rate):
+        recognizer = self._vosk.KaldiRecognizer(self._model, sample_rate, self._grammar)
+        recognizer.AcceptWaveform(pcm)
+        text = json.loads(recognizer.FinalResult()).get("text", "")
+        text = " ".join(word for word in text.split() if word != "[unk]")
+        return text or None
+
+
+def mfcc(samples, sample_rate, num_coefficients=13, num_filters=26, frame_ms=25, hop_ms=10):
+    """Mel-frequency cepstral coefficients of int16 or float samples, shape (frames, coefficients)"""
+    samples = np.asarray(samples, dtype=np.float32)
+    samples = np.append(samples[0], samples[1:] - 0.97 * samples[:-1])     # pre-emphasis
+
+    frame_length = int(sample_rate * frame_ms / 1000)
+    hop = int(sample_rate * hop_ms / 1000)
+    if len(samples) < frame_length:
+        samples = np.pad(samples, (0, frame_length - len(samples)))
+    count = 1 + (len(samples) - frame_length) // hop
+    indexes = np.arange(frame_length)[np.newaxis, :] + hop * np.arange(count)[:, np.newaxis]
+    frames = samples[indexes] * np.hamming(frame_length)
+
+    n_fft = 512
+    power = np.abs(np.fft.rfft(frames, n_fft)) ** 2 / n_fft
+
+    # Triangular filters evenly spaced on the mel scale
+    mel_points = np.linspace(0, 2595 * np.log10(1 + sample_rate / 2 / 700), num_filters + 2)
+    bins = np.floor((n_fft + 1) * 700 * (10 ** (mel_points / 2595) - 1) / sample_rate).astype(int)
+    filters = np.zeros((num_filters, n_fft // 2 + 1))
+    for i in range(1, num_filters + 1):
+        left, center, right = bins[i - 1], bins[i], bins[i + 1]
+        filters[i - 1, left:center] = (np.arange(left, center) - left) / max(center - left, 1)
+        filters[i - 1, center:right] = (right - np.arange(center, right)) / max(right - center, 1)
+    energies = np.log(np.maximum(power @ filters.T, 1e-10))
+
+    # DCT-II keeps the first coefficients of the log filterbank energies
+    n = np.arange(num_filters)
+    dct = np.cos(np.pi / num_filters * (n[np.newaxis, :] + 0.5) * np.arange(num_coefficients)[:, np.newaxis])
+    coefficients = energies @ dct.T
+
+    # Drop leading and trailing silence, then normalize away the channel (cepstral mean)
+    frame_energy = energies.max(axis=1)
+    voiced = np.flatnonzero(frame_energy > frame_energy.max() - 6)
+    if len(voiced):
+        coefficients = coefficients[voiced[0]:voiced[-1] + 1]
+    return coefficients - coefficients.mean(axis=0)
+
+
+def dtw_distance(a, b):
+    """Dynamic time warping distance between two feature sequences, normalized by their lengths"""
+    cost = np.sqrt(((a[:, np.newaxis, :] - b[np.newaxis, :, :]) ** 2).sum(axis=2)).tolist()
+    previous = [float("inf")] * (len(b) + 1)
+    previous[0] = 0.0
+    for i in range(len(a)):
+        row = cost[i]
+        current = [float("inf")] * (len(b) + 1)
+        for j in range(len(b)):
+            current[j + 1] = row[j] + min(previous[j + 1], previous[j], current[j])
+        previous = current
+    return previous[-1] / (len(a) + len(b))
+
+
+def read_wav(path):
+    """Samples and sample rate of a 16-bit mono WAV file"""
+    with wave.open(path, 'rb') as wav:
+        if wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+            raise ValueError(f"{path} must be 16-bit mono")
+        return np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16), wav.getframerate()
+
+
+class TemplateRecognizer:
+    """Small-vocabulary keyword matching: nearest recorded template by MFCC + DTW distance
+
+    Needs no network and no model download, just a few recordings of each word
+    by the people who will use it. Runs in tens of milliseconds on a Raspberry Pi.
+    """
+
+    name = "template"
+
+    def __init__(self, templates_dir=None):
+        self.templates = []     # (word, mfcc sequence)
+        templates_dir = templates_dir or config.COMMAND_TEMPLATES_DIR
+        for path in sorted(glob.glob(os.path.join(templates_dir, "*", "*.wav"))):
+            word = os.path.basename(os.path.dirname(path)).lower()
+            samples, sample_rate = read_wav(path)
+            self.templates.append((word, mfcc(samples, sample_rate)))
+        if not self.templates:
+            raise ValueError(f"No command templates found in {templates_dir}/<word>/*.wav")
+
+    def recognize(self, pcm, sample_rate):
+        features = mfcc(np.frombuffer(pcm, dtype=np.int16), sample_rate)
+        word, distance = min(((word, dtw_distance(features, template)) for word, template in self.templates),
+                             key=lambda match: match[1])
+        return word if distance <= config.TEMPLATE_MAX_DISTANCE else None
+
+
+RECOGNIZERS = {recognizer.name: recognizer for recognizer in (GoogleRecognizer, VoskRecognizer, TemplateRecognizer)}
+
+
+def create_recognizer(name):
+    """Instantiate a command recognizer by name"""
+    if name not in RECOGNIZERS:
+        raise ValueError(f"Unknown command recognizer '{name}', available: {', '.join(RECOGNIZERS)}")
+    return RECOGNIZERS[name]()
@@ -2,6 +2,11 @@
 SERVER_IP = "192.168.1.100"  # Change this to your server's IP
 SERVER_PORT = 5000
 API_ENDPOINT = f"http://{SERVER_IP}:{SERVER_PORT}/api/process_command"
+BATCH_ENDPOINT = f"http://{SERVER_IP}:{SERVER_PORT}/api/recognize_batch"
+SESSION_ENDPOINT = f"http://{SERVER_IP}:{SERVER_PORT}/api/session"
+WAIT_FOR_ACTUATION = False  # True: the server answers only after the smart home hub executed the command
+REQUEST_TIMEOUT = (2, 5)  # (connect, read) seconds for server requests
+CLIENT_ID = None  # Sent as X-Client-Id so the server tells clients apart (repeated commands, smoothing), None: the host name
 
 # Porcupine wake word settings
 PORCUPINE_ACCESS_KEY = "YOUR_PORCUPINE_ACCESS_KEY_HERE"  # Get from https://console.picovoice.ai/
@@ -11,8 +16,39 @@ WAKE_WORDS = ["jarvis"]  # Available: alexa, americano, blueberry, bumblebee, co
 # Audio settings
 SAMPLE_RATE = 16000
 CHUNK_SIZE = 512
+AUDIO_SOURCE = "microphone"  # Or the path of a 16 kHz mono 16-bit WAV file, for testing without a microphone
+AUDIO_BUFFER_SECONDS = 10  # PCM kept in the ring buffer shared by wake word detection and command capture
+COMMAND_TIMEOUT = 5  # Seconds to start speaking after the wake word
+PHRASE_TIME_LIMIT = 4  # Longest command recorded, in seconds
+PAUSE_THRESHOLD = 0.6  # Seconds of silence that end a command
+NOISE_MULTIPLIER = 3.0  # Speech must be this many times louder than the continuously measured background noise
+MIN_ENERGY_THRESHOLD = 100  # Lower bound of the speech threshold (RMS of 16-bit samples)
+
+# Command recognition: "google" (cloud), "vosk" (offline, needs pip install vosk) or "template" (offline)
+COMMAND_RECOGNIZER = "google"
+COMMAND_VOCABULARY = ["turn", "on", "off"]  # Words the offline recognizers can hear
+VOSK_MODEL_PATH = "vosk-model-small-en-us-0.15"  # Unpacked from https://alphacephei.com/vosk/models
+COMMAND_TEMPLATES_DIR = "command_templates"  # Recordings for the template recognizer: <word>/*.wav
+TEMPLATE_MAX_DISTANCE = 15  # Larger accepts more, including noise, check with benchmark_commands.py
 
 # Camera settings
 CAMERA_INDEX = 0
+CAMERA_SOURCE = CAMERA_INDEX  # Camera index, path of a video file (played in a loop) or "synthetic" for testing
 IMAGE_WIDTH = 640
 IMAGE_HEIGHT = 480
+
+# Upload settings, frames are encoded continuously in the background
+# Downscaling here averages away detail the server's histogram features need (accepted recognitions drop from
+# 91% to 44% at 224x224), compare settings with server/benchmark.py --upload-devices before changing these
+UPLOAD_IMAGE_SIZE = None  # (width, height) to downscale to, None sends the camera frame as captured
+UPLOAD_JPEG_QUALITY = 95  # OpenCV's default, 80 cuts uploads to a third for a slightly lower accuracy
+PREENCODE_INTERVAL = 0.2  # Seconds between pre-encoded frames
+FRAME_BUFFER_SIZE = 25  # Pre-encoded frames kept, 25 x 0.2s covers the last 5 seconds
+FRAME_MOMENT = "wake"  # Send the frames from when the wake word was heard ("wake") or the command ended ("command")
+FRAMES_PER_COMMAND = 1  # More than 1 sends that many frames around the moment and lets the server vote
+MAX_FRAME_AGE = 1.0  # Capture a fresh frame instead if no buffered frame is this close to the moment
+
+# Streaming: upload frames from the wake word on while the command is transcribed, then send only the action
+STREAMING = True
+STREAM_INTERVAL = 0.3  # Seconds between frame uploads to the session
+STREAM_MAX_FRAMES = 8  # Frames uploaded per command, keep at most MAX_SESSION_FRAMES in server/config.py
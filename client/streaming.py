@@ -0,0 +1,81 @@
+"""
+Streaming command sessions - overlap frame upload and recognition with speech transcription
+When the wake word fires a server session is opened with the frame from that moment,
+and frames keep being uploaded (and recognized by the server) while the command is
+still being spoken and transcribed. Only the action is sent once it is known, so
+the server can execute it straight away.
+"""
+
+import threading
+import config
+
+
+class CommandSession:
+    """Uploads frames to a server session on a background thread until the action is known"""
+
+    def __init__(self, http, frames, moment):
+        self.http = http
+        self.frames = frames
+        self.moment = moment
+        self.session_id = None
+        self.uploaded = 0
+        self.error = None
+        self._last_timestamp = moment - config.PREENCODE_INTERVAL   # include the frame just before the moment
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _upload(self, url):
+        """Post the frames captured since the last upload, returns the response JSON or None if there were none"""
+        entries = self.frames.since(self._last_timestamp)
+        entries = entries[:config.STREAM_MAX_FRAMES - self.uploaded]
+        if not entries and self.session_id is not None:
+            return None
+
+        files = [('images', (f'frame_{self.uploaded + i}.jpg', jpeg, 'image/jpeg')) for i, (_, jpeg) in enumerate(entries)]
+        response = self.http.post(url, files=files, timeout=config.REQUEST_TIMEOUT)
+        response.raise_for_status()
+        if entries:
+            self._last_timestamp = entries[-1][0]
+            self.uploaded += len(entries)
+        return response.json()
+
+    def _run(self):
+        try:
+            self.session_id = self._upload(config.SESSION_ENDPOINT)["session"]
+            frames_url = f"{config.SESSION_ENDPOINT}/{self.session_id}/frames"
+            while not self._done.wait(config.STREAM_INTERVAL) and self.uploaded < config.STREAM_MAX_FRAMES:
+                self._upload(frames_url)
+        except Exception as e:
+            self.error = e
+
+    def cancel(self):
+        """Stop uploading, the server drops the session after SESSION_TTL"""
+        self._done.set()
+        self._thread.join()
+
+    def finish(self, device, action):
+        """Stop uploading and send the action on the session
+
+        Returns:
+            dict: Server response, or None if the session failed and the frames must be sent another way
+        """
+        self.cancel()
+        if self.session_id is None or self.error is not None:
+            print(f"Streaming session failed: {self.error}")
+            return None
+
+        data = {'device': device, 'action': action, 'sync': '1' if config.WAIT_FOR_ACTUATION else '0'}
+        try:
+            response = self.http.post(f"{config.SESSION_ENDPOINT}/{self.session_id}/action", data=data,
+                                      timeout=config.REQUEST_TIMEOUT)
+        except Exception as e:
+            print(f"Error sending action: {e}")
+            return None
+        if response.status_code == 410:
+            # Session expired or landed on another server worker, a 404 is an unrecognized device
+            return None
+        return response.json()
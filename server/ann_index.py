@@ -0,0 +1,105 @@
+"""
+Approximate nearest-neighbour backends for FeatureIndex
+Enable one with ANN_BACKEND in config.py. The backend only proposes candidate
+rows, FeatureIndex still scores those exactly, so a miss costs accuracy but
+never returns a wrong similarity value.
+"""
+
+import numpy as np
+import config
+
+
+class LSHIndex:
+    """Random-projection (sign of random hyperplanes) LSH over index row positions
+
+    Each of `tables` hash tables buckets rows by a `bits`-bit signature. A query
+    collects the rows sharing its bucket in every table, plus the buckets reached
+    by flipping its `probes` least confident bits (multi-probe LSH).
+    """
+
+    def __init__(self, tables=8, bits=12, probes=2, seed=0):
+        self.tables = tables
+        self.bits = bits
+        self.probes = probes
+        self.seed = seed
+        self._planes = None     # (tables * bits, dim) random hyperplanes
+        self._center = None     # hyperplanes pass through this point instead of the origin
+        self._weights = 1 << np.arange(bits, dtype=np.int64)
+        self.clear()
+
+    def clear(self):
+        """Drop every row, the hyperplanes are re-centered on the next insert"""
+        self._buckets = [{} for _ in range(self.tables)]
+        self._codes = {}        # row position -> signature per table
+        self._center = None
+
+    def _projections(self, vectors):
+        """Signed distance of vectors to every hyperplane, shape (n, tables, bits)"""
+        if self._planes is None or self._planes.shape[1] != vectors.shape[1]:
+            rng = np.random.default_rng(self.seed)
+            self._planes = rng.standard_normal((self.tables * self.bits, vectors.shape[1])).astype(np.float32)
+        if self._center is None:
+            # Histogram features all live in the positive orthant, so split around their mean
+            self._center = vectors.mean(axis=0)
+        projections = (vectors - self._center) @ self._planes.T
+        return projections.reshape(len(vectors), self.tables, self.bits)
+
+    def _signatures(self, projections):
+        return (projections > 0).astype(np.int64) @ self._weights
+
+    def insert(self, positions, vectors):
+        """Add rows at the given index positions"""
+        if len(positions) == 0:
+            return
+        codes = self._signatures(self._projections(vectors))
+        for position, row_codes in zip(positions, codes):
+            position = int(position)
+            self._codes[position] = row_codes
+            for table, code in enumerate(row_codes):
+                self._buckets[table].setdefault(int(code), set()).add(position)
+
+    def remove(self, positions):
+        """Drop rows at the given index positions"""
+        for position in positions:
+            row_codes = self._codes.pop(int(position), None)
+            if row_codes is None:
+                continue
+            for table, code in enumerate(row_codes):
+                bucket = self._buckets[table].get(int(code))
+                if bucket is not None:
+                    bucket.discard(int(position))
+                    if not bucket:
+                        del self._buckets[table][int(code)]
+
+    def rebuild(self, vectors):
+        """Re-insert every row after the index was compacted"""
+        self.clear()
+        self.insert(np.arange(len(vectors)), vectors)
+
+    def candidates(self, query):
+        """Row positions that may be close to the query"""
+        if not self._codes:
+            return np.empty(0, dtype=np.int64)
+        projections = self._projections(query[np.newaxis, :])[0]
+        codes = self._signatures(projections[np.newaxis, :])[0]
+
+        found = set()
+        for table in range(self.tables):
+            code = int(codes[table])
+            probe_codes = [code]
+            # Flip the bits whose hyperplane the query is closest to
+            for bit in np.argsort(np.abs(projections[table]))[:self.probes]:
+                probe_codes.append(code ^ (1 << int(bit)))
+            for probe_code in probe_codes:
+                found.update(self._buckets[table].get(probe_code, ()))
+        return np.fromiter(found, dtype=np.int64, count=len(found))
+
+
+def create_ann_index():
+    """Build the approximate index selected in config.py, or None for exact scans"""
+    backend = config.ANN_BACKEND
+    if not backend:
+        return None
+    if backend == "lsh":
+        return LSHIndex(tables=config.ANN_LSH_TABLES, bits=config.ANN_LSH_BITS, probes=config.ANN_LSH_PROBES)
+    raise ValueError(f"Unknown ANN backend '{backend}', use None or 'lsh'")
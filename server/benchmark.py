@@ -0,0 +1,502 @@
+"""
+Recognition benchmark - measures how the server behaves as the device catalog grows
+Generates synthetic device photo sets, populates a DeviceRecognizer in a temporary
+directory and writes the results as JSON so runs can be compared between commits.
+
+Usage:
+    cd server && python3 benchmark.py --devices 10,100,1000 --output bench.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+import config
+
+
+def percentiles(samples):
+    """Summary of latency samples in milliseconds"""
+    samples_ms = np.asarray(samples) * 1000
+    return {
+        "count": len(samples_ms),
+        "mean_ms": float(samples_ms.mean()),
+        "p50_ms": float(np.percentile(samples_ms, 50)),
+        "p90_ms": float(np.percentile(samples_ms, 90)),
+        "p99_ms": float(np.percentile(samples_ms, 99)),
+        "max_ms": float(samples_ms.max())
+    }
+
+
+class SyntheticCatalog:
+    """Random 'devices', each a fixed arrangement of colored shapes on a colored background
+
+    Every photo of a device re-renders the same scene with a random shift, scale,
+    brightness and sensor noise, so photos of one device resemble each other more
+    than photos of different devices.
+    """
+
+    def __init__(self, seed=0, size=(640, 480), photo_size=(320, 240)):
+        self.rng = np.random.default_rng(seed)
+        cv2.setRNGSeed(seed)
+        self.size = size                # query frames, like the client sends
+        self.photo_size = photo_size    # training photos, smaller so big catalogs build quickly
+        self._scenes = []
+
+    def _scene(self, device_id):
+        while len(self._scenes) <= device_id:
+            shapes = []
+            for _ in range(self.rng.integers(2, 6)):
+                shapes.append({
+                    "kind": self.rng.choice(["rect", "circle"]),
+                    "center": self.rng.uniform(0.2, 0.8, 2),
+                    "extent": self.rng.uniform(0.05, 0.3, 2),
+                    "color": self.rng.integers(0, 256, 3).tolist()
+                })
+            self._scenes.append({"background": self.rng.integers(0, 256, 3).tolist(), "shapes": shapes})
+        return self._scenes[device_id]
+
+    def frame(self, device_id, size=None):
+        """Render one BGR photo of a device"""
+        scene = self._scene(device_id)
+        width, height = size or self.size
+        image = np.empty((height, width, 3), dtype=np.uint8)
+        image[:] = scene["background"]
+
+        shift = self.rng.uniform(-0.05, 0.05, 2)
+        scale = self.rng.uniform(0.9, 1.1)
+        for shape in scene["shapes"]:
+            cx, cy = (shape["center"] + shift) * (width, height)
+            ex, ey = shape["extent"] * scale * (width, height)
+            if shape["kind"] == "rect":
+                cv2.rectangle(image, (int(cx - ex), int(cy - ey)), (int(cx + ex), int(cy + ey)), shape["color"], -1)
+            else:
+                cv2.circle(image, (int(cx), int(cy)), int(min(ex, ey)), shape["color"], -1)
+
+        image = cv2.convertScaleAbs(image, alpha=self.rng.uniform(0.8, 1.2))
+        noise = np.empty(image.shape, dtype=np.int16)
+        cv2.randn(noise, (0, 0, 0), (8, 8, 8))
+        return cv2.add(image, noise, dtype=cv2.CV_8U)
+
+    def jpeg(self, device_id, quality=90, size=None):
+        """Render one photo of a device as JPEG bytes"""
+        frame = self.frame(device_id, size)
+        return cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+    def photos(self, device_id, count):
+        """Training photos of a device as JPEG bytes"""
+        return [self.jpeg(device_id, size=self.photo_size) for _ in range(count)]
+
+
+@contextlib.contextmanager
+def isolated_storage():
+    """Point the recognizer's storage settings at a fresh temporary directory"""
+    keys = ["DEVICE_PHOTOS_DIR", "DEVICE_THUMBNAILS_DIR", "DEVICES_DATABASE", "FEATURE_STORE", "DEVICES_METADATA",
+            "DEVICES_JOURNAL", "JOBS_STATE_DIR", "METRICS_DIR"]
+    saved = {key: getattr(config, key) for key in keys}
+    workdir = tempfile.mkdtemp(prefix="va_bench_")
+    try:
+        for key in keys:
+            setattr(config, key, os.path.join(workdir, os.path.basename(saved[key])))
+        yield workdir
+    finally:
+        for key, value in saved.items():
+            setattr(config, key, value)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def check_index_consistency(catalog, edits=12):
+    """Edit photos with a journal compacted every few edits and check the index still matches the catalog
+
+    Compaction renumbers the rows the index is keyed by; if the index is not
+    rebuilt, deleted photos keep matching or other photos' vectors get dropped.
+    """
+    from device_recognition import DeviceRecognizer
+
+    saved = config.JOURNAL_COMPACT_EVERY
+    config.JOURNAL_COMPACT_EVERY = 4
+    try:
+        with isolated_storage():
+            recognizer = DeviceRecognizer()
+            recognizer.add_device("lamp", catalog.photos(0, 4))
+            recognizer.add_device("fan", catalog.photos(1, 2))
+            for edit in range(edits):
+                if edit % 3 == 2:
+                    recognizer._recalculate_device_features("lamp")
+                else:
+                    recognizer.add_device_images("lamp", catalog.photos(0, 1))
+                    recognizer.delete_device_image("lamp", recognizer.devices["lamp"]["images"][0]["file"])
+                expected = {name: {image["row"] for image in device_data["images"]}
+                            for name, device_data in recognizer.devices.items()}
+                if recognizer.index.keys() != expected:
+                    raise RuntimeError(f"Feature index out of sync with the catalog after edit {edit + 1}: "
+                                       f"index {recognizer.index.keys()}, catalog {expected}")
+            return {"edits": edits, "row_moves": recognizer.store.row_moves}
+    finally:
+        config.JOURNAL_COMPACT_EVERY = saved
+
+
+def bench_extract_features(catalog, samples):
+    """Time extract_features on full-size frames"""
+    from device_recognition import DeviceRecognizer
+
+    with isolated_storage():
+        recognizer = DeviceRecognizer()
+        frames = [catalog.frame(i % 10) for i in range(samples)]
+        timings = []
+        for frame in frames:
+            start = time.perf_counter()
+            recognizer.extract_features(frame)
+            timings.append(time.perf_counter() - start)
+    return percentiles(timings)
+
+
+def bench_decode(catalog, samples):
+    """Query decoding in full versus at reduced resolution, per extractor and in regions mode
+
+    Times decode_query() plus what follows it (feature extraction, or the
+    downscale before region windows are scored), and records the decoded size
+    and the Python-visible peak allocation of one request.
+    """
+    import tracemalloc
+    from device_recognition import DeviceRecognizer
+    from feature_extractors import EXTRACTORS
+    from regions import resize_longest
+
+    # Full camera frames, as sent by clients that don't downscale before uploading
+    payloads = [catalog.jpeg(i % 10, quality=80) for i in range(samples)]
+    saved = config.REDUCED_DECODE, config.RECOGNITION_MODE
+    cases = [(name, "global") for name in EXTRACTORS] + [(config.FEATURE_EXTRACTOR, "regions")]
+    results = []
+    try:
+        with isolated_storage():
+            recognizer = DeviceRecognizer()
+            for extractor_name, mode in cases:
+                recognizer.extractor = EXTRACTORS[extractor_name]
+                config.RECOGNITION_MODE = mode
+
+                def process(payload):
+                    image = recognizer.decode_query(payload)
+                    if mode == "regions":
+                        return image, resize_longest(image, config.ROI_IMAGE_SIZE)[0]
+                    return image, recognizer.extract_features(image)
+
+                case = {"extractor": extractor_name, "mode": mode}
+                outputs = {}
+                for reduced in (False, True):
+                    config.REDUCED_DECODE = reduced
+                    timings = []
+                    for payload in payloads:
+                        start = time.perf_counter()
+                        process(payload)
+                        timings.append(time.perf_counter() - start)
+
+                    tracemalloc.start()
+                    image, output = process(payloads[0])
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+
+                    outputs[reduced] = [process(payload)[1] for payload in payloads[:20]]
+                    case["reduced" if reduced else "full"] = {
+                        "latency": percentiles(timings),
+                        "decoded_shape": list(image.shape),
+                        "decoded_bytes": int(image.nbytes),
+                        "peak_alloc_bytes": int(peak)
+                    }
+
+                if mode == "global":
+                    # How much reduced decoding changes the features the catalog is matched against
+                    similarities = [float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+                                    for a, b in zip(outputs[False], outputs[True])]
+                    case["feature_similarity"] = float(np.mean(similarities))
+                results.append(case)
+    finally:
+        config.REDUCED_DECODE, config.RECOGNITION_MODE = saved
+    return results
+
+
+def bench_catalog(catalog, device_count, images_per_device, queries):
+    """Populate a catalog of device_count devices and measure recognition and startup"""
+    from device_recognition import DeviceRecognizer
+
+    with isolated_storage():
+        recognizer = DeviceRecognizer()
+
+        start = time.perf_counter()
+        for device_id in range(device_count):
+            recognizer.add_device(f"device_{device_id}", catalog.photos(device_id, images_per_device))
+        populate_s = time.perf_counter() - start
+
+        query_ids = catalog.rng.integers(0, device_count, queries)
+        frames = [catalog.frame(int(device_id)) for device_id in query_ids]
+        timings = []
+        correct = 0
+        for device_id, frame in zip(query_ids, frames):
+            start = time.perf_counter()
+            recognized_device, _ = recognizer.recognize_device(frame)
+            timings.append(time.perf_counter() - start)
+            correct += recognized_device == f"device_{device_id}"
+
+        # Startup cost: snapshot + journal replay + index build
+        start = time.perf_counter()
+        reloaded = DeviceRecognizer()
+        load_s = time.perf_counter() - start
+
+        return {
+            "devices": device_count,
+            "images": device_count * images_per_device,
+            "populate_s": populate_s,
+            "load_devices_s": load_s,
+            "recognize_device": percentiles(timings),
+            "accuracy": correct / queries,
+            "index_bytes": reloaded.index.nbytes,
+            "store_bytes": os.path.getsize(reloaded.store.vectors_path),
+            "approximate_recall": reloaded.measure_ann_recall(samples=min(200, device_count * images_per_device))
+        }
+
+
+def bench_dtypes(catalog, device_count, images_per_device, queries):
+    """Memory, latency and accuracy of each index storage type against float32 on the same vectors"""
+    from feature_extractors import get_extractor
+    from feature_index import DTYPES, FeatureIndex
+
+    extractor = get_extractor(config.FEATURE_EXTRACTOR)
+    training = {f"device_{device_id}": np.array([extractor.extract(catalog.frame(device_id, catalog.photo_size))
+                                                  for _ in range(images_per_device)])
+                for device_id in range(device_count)}
+    query_ids = catalog.rng.integers(0, device_count, queries)
+    query_vectors = np.array([extractor.extract(catalog.frame(int(device_id))) for device_id in query_ids])
+    expected = np.array([f"device_{device_id}" for device_id in query_ids])
+
+    results = []
+    reference = None
+    for dtype in DTYPES:
+        index = FeatureIndex(dtype=dtype, prototype_top_k=config.PROTOTYPE_TOP_K)
+        for device_name, vectors in training.items():
+            index.add(device_name, vectors)
+
+        timings = []
+        for query in query_vectors:
+            start = time.perf_counter()
+            index.search(query)
+            timings.append(time.perf_counter() - start)
+        names, scores = index.device_scores_batch(query_vectors)
+        top = np.asarray(names)[scores.argmax(axis=1)]
+        best = scores.max(axis=1)
+        if reference is None:
+            reference = (top, best)
+
+        results.append({
+            "dtype": dtype,
+            "index_bytes": index.nbytes,
+            "bytes_per_vector": index.nbytes / len(index),
+            "search": percentiles(timings),
+            "accuracy": float(np.mean(top == expected)),
+            "top1_agreement": float(np.mean(top == reference[0])),
+            "mean_abs_score_delta": float(np.mean(np.abs(best - reference[1])))
+        })
+    return results
+
+
+def bench_http(catalog, device_count, images_per_device, requests_count):
+    """End-to-end /api/process_command throughput through Flask's test client"""
+    with isolated_storage():
+        from device_recognition import DeviceRecognizer
+        recognizer = DeviceRecognizer()
+        for device_id in range(device_count):
+            recognizer.add_device(f"device_{device_id}", catalog.photos(device_id, images_per_device))
+
+        # Every request pays for decoding, extraction and the scan, as with a moving camera
+        recognizer.result_cache.max_entries = 0
+
+        import server
+        server.recognizer = recognizer
+        # All requests come from one client, which must neither reuse recognitions nor be debounced
+        server.clients.reuse_ttl = 0
+        server.clients.debounce_interval = 0
+        client = server.app.test_client()
+
+        payloads = [catalog.jpeg(int(device_id)) for device_id in catalog.rng.integers(0, device_count, requests_count)]
+        timings = []
+        statuses = {}
+        start_all = time.perf_counter()
+        # The debug automation module prints every command
+        with contextlib.redirect_stdout(io.StringIO()):
+            for payload in payloads:
+                start = time.perf_counter()
+                response = client.post('/api/process_command', data={
+                    "device": "visual_target",
+                    "action": "on",
+                    "image": (io.BytesIO(payload), "image.jpg")
+                }, content_type='multipart/form-data')
+                timings.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        elapsed = time.perf_counter() - start_all
+
+    return {
+        "devices": device_count,
+        "requests": requests_count,
+        "requests_per_s": requests_count / elapsed,
+        "latency": percentiles(timings),
+        "status_codes": {str(code): count for code, count in statuses.items()}
+    }
+
+
+def bench_upload(catalog, device_count, images_per_device, queries):
+    """Recognition of camera frames at each client upload size and JPEG quality, per extractor
+
+    Check a setting here before changing UPLOAD_IMAGE_SIZE or UPLOAD_JPEG_QUALITY
+    in client/config.py: a client-side downscale averages away pixel detail the
+    histogram features were trained on, unlike the server's own resize.
+    """
+    from device_recognition import DeviceRecognizer
+    from feature_extractors import EXTRACTORS
+
+    # (size, JPEG quality), None for the full camera frame, the first one is what clients sent originally
+    settings = [(None, 95), (None, 80), ((320, 240), 95), (config.TARGET_IMAGE_SIZE, 80)]
+    query_ids = catalog.rng.integers(0, device_count, queries)
+    frames = [catalog.frame(int(device_id)) for device_id in query_ids]
+    photos = {device_id: catalog.photos(device_id, images_per_device) for device_id in range(device_count)}
+
+    saved = config.FEATURE_EXTRACTOR
+    results = []
+    try:
+        for extractor_name in EXTRACTORS:
+            config.FEATURE_EXTRACTOR = extractor_name
+            with isolated_storage():
+                recognizer = DeviceRecognizer()
+                for device_id, device_photos in photos.items():
+                    recognizer.add_device(f"device_{device_id}", device_photos)
+
+                for size, quality in settings:
+                    correct = accepted = 0
+                    similarities = []
+                    upload_bytes = 0
+                    for device_id, frame in zip(query_ids, frames):
+                        if size is not None:
+                            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                        payload = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+                        upload_bytes += len(payload)
+                        recognized_device, similarity = recognizer.recognize_device(recognizer.decode_query(payload))
+                        accepted += recognized_device is not None
+                        correct += recognized_device == f"device_{device_id}"
+                        similarities.append(similarity)
+                    results.append({
+                        "extractor": extractor_name,
+                        "size": list(size or catalog.size),
+                        "jpeg_quality": quality,
+                        "mean_upload_bytes": upload_bytes / queries,
+                        "accuracy": correct / queries,
+                        "accepted": accepted / queries,
+                        "mean_similarity": float(np.mean(similarities))
+                    })
+    finally:
+        config.FEATURE_EXTRACTOR = saved
+    return results
+
+
+def git_commit():
+    """Current commit of the working tree, if it is a git checkout"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VisualAssistant recognition benchmark")
+    parser.add_argument("--devices", default="10,100,1000,10000",
+                        help="comma separated catalog sizes (default: 10,100,1000,10000)")
+    parser.add_argument("--images-per-device", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200, help="recognition queries per catalog size")
+    parser.add_argument("--extract-samples", type=int, default=200)
+    parser.add_argument("--decode-samples", type=int, default=200)
+    parser.add_argument("--dtype-devices", type=int, default=1000, help="catalog size for the storage type comparison")
+    parser.add_argument("--http-requests", type=int, default=200)
+    parser.add_argument("--http-devices", type=int, default=100, help="catalog size for the HTTP benchmark")
+    parser.add_argument("--upload-devices", type=int, default=100,
+                        help="catalog size for the client upload settings comparison")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    catalog = SyntheticCatalog(seed=args.seed)
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.time(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "feature_extractor": config.FEATURE_EXTRACTOR,
+            "ann_backend": config.ANN_BACKEND,
+            "prototype_top_k": config.PROTOTYPE_TOP_K,
+            "feature_dtype": config.FEATURE_DTYPE,
+            "images_per_device": args.images_per_device
+        }
+    }
+
+    print("Checking the feature index against the catalog through compactions...")
+    results["index_consistency"] = check_index_consistency(catalog)
+
+    print("Benchmarking extract_features...")
+    results["extract_features"] = bench_extract_features(catalog, args.extract_samples)
+
+    print("Benchmarking reduced-resolution decoding...")
+    results["decode"] = bench_decode(catalog, args.decode_samples)
+
+    results["catalogs"] = []
+    for device_count in [int(n) for n in args.devices.split(",") if n]:
+        print(f"Benchmarking a catalog of {device_count} devices...")
+        results["catalogs"].append(bench_catalog(catalog, device_count, args.images_per_device, args.queries))
+
+    if args.dtype_devices > 0:
+        print(f"Comparing index storage types with {args.dtype_devices} devices...")
+        results["dtypes"] = bench_dtypes(catalog, args.dtype_devices, args.images_per_device, args.queries)
+
+    if args.http_requests > 0:
+        print(f"Benchmarking /api/process_command with {args.http_devices} devices...")
+        results["http"] = bench_http(catalog, args.http_devices, args.images_per_device, args.http_requests)
+
+    if args.upload_devices > 0:
+        print(f"Comparing client upload settings with {args.upload_devices} devices...")
+        results["upload"] = bench_upload(catalog, args.upload_devices, args.images_per_device, args.queries)
+
+    # Peak resident set size of the whole run (kilobytes on Linux)
+    results["meta"]["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    for case in results["decode"]:
+        full, reduced = case["full"], case["reduced"]
+        print(f"Decode {case['extractor']}/{case['mode']}: p50 {full['latency']['p50_ms']:.2f}ms -> "
+              f"{reduced['latency']['p50_ms']:.2f}ms, {full['decoded_bytes']} -> {reduced['decoded_bytes']} bytes decoded")
+    for catalog_result in results["catalogs"]:
+        latency = catalog_result["recognize_device"]
+        print(f"{catalog_result['devices']:>6} devices: p50 {latency['p50_ms']:.2f}ms, "
+              f"p99 {latency['p99_ms']:.2f}ms, accuracy {catalog_result['accuracy']:.2%}, "
+              f"load {catalog_result['load_devices_s']:.3f}s")
+    for case in results.get("dtypes", []):
+        print(f"Index {case['dtype']:>7}: {case['bytes_per_vector']:.0f} bytes/vector, "
+              f"p50 {case['search']['p50_ms']:.2f}ms, accuracy {case['accuracy']:.2%}, "
+              f"agreement with float32 {case['top1_agreement']:.2%}, score delta {case['mean_abs_score_delta']:.4f}")
+    for case in results.get("upload", []):
+        print(f"Upload {case['extractor']} {case['size'][0]}x{case['size'][1]} q{case['jpeg_quality']}: "
+              f"{case['mean_upload_bytes'] / 1024:.0f} KB, accuracy {case['accuracy']:.2%}, "
+              f"accepted {case['accepted']:.2%}, mean similarity {case['mean_similarity']:.3f}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
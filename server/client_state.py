@@ -0,0 +1,144 @@
+import collections
+import threading
+import time
+import numpy as np
+
+
+class ClientStates:
+    """Recent recognitions and commands of each client, for commands sent in quick succession
+
+    Three things are remembered per client (its X-Client-Id header or address):
+
+    - the device scores of its recent frames, averaged with the newest weighted
+      most so a single blurred frame doesn't lose the device (smooth())
+    - its last confident recognition and the features it came from, reused
+      without scoring the catalog while new frames barely differ (reuse())
+    - when each device + action was last executed, so repeats within the
+      debounce interval are not sent to the hub again (claim())
+
+    Recognitions are tagged with the result cache generation, so catalog
+    edits discard them. Held in process memory, the least recently seen
+    client is forgotten beyond max_clients.
+    """
+
+    def __init__(self, window=5, reuse_ttl=3, reuse_similarity=0.98, debounce=1.5, max_clients=256):
+        self.window = window
+        self.reuse_ttl = reuse_ttl
+        self.reuse_similarity = reuse_similarity
+        self.debounce_interval = debounce
+        self.max_clients = max_clients
+        self._clients = collections.OrderedDict()   # client id -> state, least recently seen first
+        self._lock = threading.Lock()
+        self.stats = {"smoothed": 0, "reused": 0, "debounced": 0}
+
+    def after_fork(self):
+        """Re-create the lock in a forked server process, its counters start from zero"""
+        self._lock = threading.Lock()
+        self.stats = dict.fromkeys(self.stats, 0)
+
+    def _state(self, client):
+        """State of a client, created on first sight (lock held)"""
+        state = self._clients.get(client)
+        if state is None:
+            state = self._clients[client] = {
+                "scores": collections.deque(),  # (time, generation, {device: score}) of recent frames
+                "last": None,                   # last confident recognition, see remember()
+                "actions": {}                   # (device, action) -> time last executed
+            }
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        self._clients.move_to_end(client)
+        return state
+
+    def reuse(self, client, features, generation):
+        """(device name, confidence) of the client's last recognition if it is fresh and the features barely moved
+
+        Returns None when the catalog has to be scored.
+        """
+        if self.reuse_ttl <= 0:
+            return None
+        with self._lock:
+            last = self._state(client)["last"]
+            if last is None or last["generation"] != generation or time.time() - last["time"] > self.reuse_ttl:
+                return None
+            norm = np.linalg.norm(features)
+            if norm == 0 or float(np.dot(last["features"], features)) / norm < self.reuse_similarity:
+                return None
+            self.stats["reused"] += 1
+            return last["device"], last["confidence"]
+
+    def remember(self, client, features, device_name, confidence, generation):
+        """Keep a confident recognition for reuse(), a miss forgets the previous one"""
+        with self._lock:
+            state = self._state(client)
+            if device_name is None:
+                state["last"] = None
+                return
+            norm = np.linalg.norm(features)
+            state["last"] = {
+                "time": time.time(),
+                "generation": generation,
+                "features": np.asarray(features, dtype=np.float32) / (norm or 1.0),
+                "device": device_name,
+                "confidence": confidence
+            }
+
+    def smooth(self, client, scores, generation):
+        """Add a frame's {device: score} and return it combined with the client's recent frames
+
+        Each device keeps the better of its score in this frame and its average
+        over the window, older frames weighing linearly less. A device seen
+        clearly a moment ago survives a blurred frame, while turning to another
+        device is not held back by the previous one. Returns the combined scores
+        and the number of frames they cover.
+        """
+        if self.window <= 0:
+            return scores, 1
+        now = time.time()
+        with self._lock:
+            history = self._state(client)["scores"]
+            while history and (now - history[0][0] > self.window or history[0][1] != generation):
+                history.popleft()
+            history.append((now, generation, scores))
+            if len(history) == 1:
+                return scores, 1
+
+            totals, weights = {}, {}
+            for seen, _, frame_scores in history:
+                weight = 1 - (now - seen) / self.window
+                for device_name, score in frame_scores.items():
+                    totals[device_name] = totals.get(device_name, 0.0) + weight * score
+                    weights[device_name] = weights.get(device_name, 0.0) + weight
+            self.stats["smoothed"] += 1
+            return {device_name: max(score, totals[device_name] / weights[device_name])
+                    for device_name, score in scores.items()}, len(history)
+
+    def claim(self, client, device_name, action):
+        """Reserve a command for execution, False if this client's same command ran within the debounce interval
+
+        The claim also holds off repeats while the command is being executed;
+        release() it when the execution fails so that a retry goes through.
+        """
+        if self.debounce_interval <= 0:
+            return True
+        now = time.time()
+        with self._lock:
+            actions = self._state(client)["actions"]
+            for command in [command for command, executed in actions.items()
+                            if now - executed > self.debounce_interval]:
+                del actions[command]
+            if (device_name, action) in actions:
+                self.stats["debounced"] += 1
+                return False
+            actions[(device_name, action)] = now
+            return True
+
+    def release(self, client, device_name, action):
+        """Forget a claimed command that was not executed"""
+        with self._lock:
+            self._state(client)["actions"].pop((device_name, action), None)
+
+    def summary(self):
+        """Counters and number of tracked clients"""
+        with self._lock:
+            return dict(self.stats, clients=len(self._clients))
@@ -6,13 +6,69 @@ PORT = 5000
 # Set DEBUG=False in environment variable for production
 DEBUG = os.getenv('FLASK_DEBUG', 'True').lower() in ['true', '1', 'yes']
 
+# Production serving: gunicorn -c gunicorn.conf.py wsgi:app
+WSGI_WORKERS = int(os.getenv('WSGI_WORKERS', '4'))  # Worker processes, they share the pre-loaded feature index
+WSGI_THREADS = 2  # Request threads per worker process
+JOBS_STATE_DIR = "job_state"  # Background job status files, readable by every worker
+METRICS_DIR = "metrics_state"  # Per-worker metric files that /metrics adds up, cleared on server start
+METRICS_FLUSH_INTERVAL = 1.0  # Seconds between writes of a worker's metric file, a scrape may lag this much behind
+
 # Device photos storage
 DEVICE_PHOTOS_DIR = "device_photos"
-DEVICES_DATABASE = "devices.json"
+DEVICE_THUMBNAILS_DIR = "device_thumbnails"  # Gallery thumbnails, made at upload time
+DEVICES_DATABASE = "devices.json"  # Legacy JSON database, migrated to the feature store on first start
+FEATURE_STORE = "device_features.f32"  # Binary float32 training vectors (memory-mapped)
+DEVICES_METADATA = "devices_meta.json"  # Device catalog snapshot for the feature store
+DEVICES_JOURNAL = "devices.journal"  # Append-only log of catalog edits since the last snapshot
+JOURNAL_COMPACT_EVERY = 200  # Fold the journal into a new snapshot after this many edits
 
 # Image processing settings
 TARGET_IMAGE_SIZE = (224, 224)
 SIMILARITY_THRESHOLD = 0.7  # Adjust based on testing
+FEATURE_EXTRACTOR = "histogram"  # "histogram" (692-dim) or "joint_hsv" (128-dim, faster, less memory)
+FEATURE_DTYPE = "float32"  # In-memory index storage: "float32", "float16" (half the memory, slower scans) or "uint8" (26%, 50% with PROTOTYPE_TOP_K), compare with benchmark.py
+
+RECOGNITION_MODE = "global"  # "global" matches the whole frame, "regions" the best window weighted towards the center
+
+# Region recognition (RECOGNITION_MODE = "regions" and /api/detect): windows aligned to a grid of cells
+ROI_IMAGE_SIZE = 320  # Longest side the frame is scaled down to before its windows are scored
+ROI_GRID = 8  # The frame is split into ROI_GRID x ROI_GRID cells
+ROI_WINDOW_SIZES = (3, 4, 6, 8)  # Window sides in cells, ROI_GRID is the whole frame
+ROI_CENTER_WEIGHT = 0.3  # Score penalty of a window centered on a frame corner, 0 treats every window alike
+
+# Approximate nearest-neighbour search for large catalogs, check /api/ann_recall when tuning
+ANN_BACKEND = None  # None for an exact scan, or "lsh" for random-projection LSH
+ANN_LSH_TABLES = 8  # More tables: higher recall, more memory
+ANN_LSH_BITS = 12  # More bits: smaller buckets, faster queries, lower recall
+ANN_LSH_PROBES = 2  # Extra neighbouring buckets probed per table
+# Score each device's mean vector first and rescore only the best K devices in full
+PROTOTYPE_TOP_K = 0  # 0 scores every device in full, ignored when ANN_BACKEND is set
+REDUCED_DECODE = True  # Decode query JPEGs at 1/2, 1/4 or 1/8 size when the features don't need more
+IN_MEMORY_UPLOAD_LIMIT = 4 * 1024 * 1024  # Requests up to this size keep their files in memory instead of temp files
+FRAME_WORKERS = 4  # Threads used to decode and extract features of uploaded images
+BACKGROUND_UPLOAD_THRESHOLD = 20  # Training uploads with more images than this run as a background job
+MAX_BATCH_FRAMES = 16  # Upper limit of frames accepted by /api/recognize_batch
+RESULT_CACHE_SIZE = 256  # Recent frames whose recognition is reused for near-identical frames, 0 disables
+RESULT_CACHE_TTL = 10  # Seconds a cached recognition stays valid
+RESULT_CACHE_MAX_DISTANCE = 2  # Differing bits (of 64) in the frame hash that still count as the same view, 0 for exact matches
+SESSION_TTL = 30  # Seconds a streaming session (/api/session) may stay idle before it is dropped
+MAX_SESSION_FRAMES = 32  # Upper limit of frames recognized per streaming session
+
+# Clients sending commands in quick succession (e.g. toggling a lamp), tracked per client
+CLIENT_ID_HEADER = "X-Client-Id"  # Clients sending this header are told apart by it instead of by their address
+SMOOTHING_WINDOW = 5  # Seconds of a client's recent frame scores averaged into its next recognition, 0 disables
+REUSE_TTL = 3  # Seconds a client's confident recognition is reused for frames whose features barely moved, 0 disables
+REUSE_MIN_SIMILARITY = 0.98  # Cosine similarity to the recognized frame's features that counts as "barely moved"
+DEBOUNCE_INTERVAL = 1.5  # Seconds in which the same device + action from one client is executed only once, 0 disables
+MAX_TRACKED_CLIENTS = 256
+DEBUG_TIMING_HEADER = "X-Debug-Timing"  # Send this request header to get a per-stage "timing_ms" breakdown back
+
+# Web UI gallery
+THUMBNAIL_SIZE = 256  # Longest side of gallery thumbnails, in pixels
+THUMBNAIL_JPEG_QUALITY = 80
+GALLERY_PAGE_SIZE = 48  # Photos per page on the edit device page
+IMAGE_CACHE_MAX_AGE = 30 * 24 * 3600  # Seconds browsers may cache photos and thumbnails, URLs change with the content
 
 # Home automation module settings
 DEFAULT_MODULE = "debug_module"  # Change to your preferred module
+AUTOMATION_ASYNC = True  # Answer the client before the hub does, clients can still send sync=1 to wait
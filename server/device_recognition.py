@@ -1,80 +1,499 @@
 import cv2
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+import hashlib
+import io
 import os
-import json
+import re
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from PIL import Image
 import config
+from ann_index import create_ann_index
+from feature_extractors import LEGACY_TAG, get_extractor, get_extractor_by_tag, tag_of
+from feature_index import FeatureIndex
+from feature_store import FeatureStore
+from image_decode import decode_reduced
+from regions import center_weights, grid_windows, resize_longest, window_boxes, window_features
+from result_cache import RecognitionCache, frame_hash
 
 class DeviceRecognizer:
     def __init__(self):
         self.devices_db_path = config.DEVICES_DATABASE
+        self.store = FeatureStore(config.FEATURE_STORE, config.DEVICES_METADATA,
+                                  config.DEVICES_JOURNAL, config.JOURNAL_COMPACT_EVERY)
+        # Guards self.devices, self.store and self.index against concurrent requests and jobs
+        self._lock = threading.RLock()
+        # Worker pool for decoding and feature extraction (OpenCV releases the GIL)
+        self.pool = ThreadPoolExecutor(max_workers=config.FRAME_WORKERS)
+        # Results for recently seen frames, emptied whenever the catalog changes
+        self.result_cache = RecognitionCache(config.RESULT_CACHE_SIZE, config.RESULT_CACHE_TTL,
+                                             config.RESULT_CACHE_MAX_DISTANCE)
         self.devices = self.load_devices()
+        self._select_extractor()
+        self._rebuild_index()
+    
+    def after_fork(self):
+        """Re-create locks and worker threads in a process forked after the recognizer was loaded"""
+        self._lock = threading.RLock()
+        self.pool = ThreadPoolExecutor(max_workers=config.FRAME_WORKERS)
+        self.result_cache.after_fork()
+        self.store.after_fork()
         
     def load_devices(self):
         """Load devices database"""
-        if os.path.exists(self.devices_db_path):
-            with open(self.devices_db_path, 'r') as f:
-                return json.load(f)
-        return {}
+        with self.store.locked(exclusive=True):
+            if not os.path.exists(config.DEVICES_METADATA) and os.path.exists(self.devices_db_path):
+                # One-time migration from the legacy JSON database
+                return self.store.migrate_from_json(self.devices_db_path, config.DEVICE_PHOTOS_DIR)
+            return self.store.load()
+    
+    @contextmanager
+    def _reading(self):
+        """Hold the locks for reading the store, caught up with edits of other processes"""
+        with self._lock, self.store.locked():
+            self._catch_up()
+            yield
+    
+    @contextmanager
+    def _writing(self):
+        """Hold the locks for changing the catalog, caught up with edits of other processes"""
+        with self._lock, self.store.locked(exclusive=True):
+            self._catch_up()
+            try:
+                yield
+            finally:
+                if self.store.row_moves != self._index_row_moves:
+                    # A compaction renumbered the rows the index is keyed by
+                    self._rebuild_index()
+                self.result_cache.invalidate()
+    
+    def refresh(self):
+        """Pick up catalog edits other server processes made since the last call
+        
+        Cheap when nothing changed: a stat() of the snapshot and the journal.
+        """
+        if self.store.changed_on_disk():
+            with self._reading():
+                pass
+    
+    def _catch_up(self):
+        """Apply new journal entries, or reload after another process wrote a snapshot"""
+        if not self.store.changed_on_disk():
+            return
+        self.result_cache.invalidate()
+        entries = self.store.tail()
+        if entries is None:
+            # Compacted or re-indexed elsewhere, rows may have moved
+            self.devices.clear()
+            self.devices.update(self.store.load())
+            self.extractor = get_extractor_by_tag(self.store.extractor) or self.extractor
+            self._rebuild_index()
+            return
+        for entry in entries:
+            self._apply_entry(entry)
+    
+    def _apply_entry(self, entry):
+        """Apply a journal entry written by another process to the catalog and the index"""
+        device_name = entry["device"]
+        before = {image["row"] for image in self.devices.get(device_name, {}).get("images", [])}
+        self.store.apply(self.devices, entry)
+        
+        if entry["op"] == "rename":
+            self.index.rename(device_name, entry["new_name"])
+        elif entry["op"] == "delete_device":
+            self.index.remove(device_name)
+        else:
+            rows = [image["row"] for image in self.devices[device_name]["images"]]
+            self.index.remove_keys(before.difference(rows))
+            added = [row for row in rows if row not in before]
+            if added:
+                self.index.add(device_name, self.store.get(added), keys=added)
+    
+    def _select_extractor(self):
+        """Use the extractor that produced the stored vectors until they are re-indexed"""
+        configured = get_extractor(config.FEATURE_EXTRACTOR)
+        if self.store.extractor is None:
+            # Stores written before extractors were selectable only hold histogram vectors
+            self.store.extractor = LEGACY_TAG if self.store.dim else tag_of(configured)
+            if not self.store.dim:
+                self.store.dim = configured.dim
+        
+        self.extractor = get_extractor_by_tag(self.store.extractor)
+        if self.extractor is None:
+            # The stored vectors can't be reproduced for queries anymore, re-index right away
+            print(f"Feature extractor {self.store.extractor} is no longer available, re-indexing...")
+            self.extractor = configured
+            self.reindex()
+    
+    def needs_reindex(self):
+        """Whether stored vectors were produced by another extractor than the configured one"""
+        return self.store.extractor != tag_of(get_extractor(config.FEATURE_EXTRACTOR))
+    
+    def reindex(self):
+        """Recompute every training vector with the configured feature extractor"""
+        extractor = get_extractor(config.FEATURE_EXTRACTOR)
+        
+        def read_and_extract(image_path):
+            try:
+                with open(image_path, 'rb') as f:
+                    image_data = f.read()
+            except OSError:
+                return None
+            image = self.decode_image(image_data)
+            if image is None:
+                return None
+            return hashlib.sha1(image_data).hexdigest(), extractor.extract(image)
+        
+        def image_paths(devices):
+            return [(device_name, image["file"], os.path.join(config.DEVICE_PHOTOS_DIR, device_name, image["file"]))
+                    for device_name, device_data in devices.items()
+                    for image in device_data["images"] if image["file"]]
+        
+        # Extract outside the lock so recognition keeps working on the old vectors meanwhile
+        with self._lock:
+            paths = [path for _, _, path in image_paths(self.devices)]
+        extracted = dict(zip(paths, self.pool.map(read_and_extract, paths)))
+        
+        with self._writing():
+            # Build the new generation next to the old one, recognition state is only swapped once it is complete
+            old_extractor, old_dim = self.store.extractor, self.store.dim
+            old_vectors_path = self.store.start_generation(tag_of(extractor), extractor.dim)
+            try:
+                devices = {}
+                for device_name, device_data in self.devices.items():
+                    filenames, hashes, features_list = [], [], []
+                    for _, filename, path in image_paths({device_name: device_data}):
+                        # Images added while extracting are picked up here
+                        result = extracted[path] if path in extracted else read_and_extract(path)
+                        if result is None:
+                            print(f"Dropping unreadable image {path} while re-indexing")
+                            continue
+                        filenames.append(filename)
+                        hashes.append(result[0])
+                        features_list.append(result[1])
+                    images = self._store_features(filenames, hashes, features_list) if filenames else []
+                    devices[device_name] = dict(device_data, images=images, image_count=len(images))
+                
+                index = self._build_index(devices)
+                row_moves = self.store.row_moves
+                self.store.compact(devices)
+            except Exception:
+                self.store.abandon_generation(self.devices, old_vectors_path, old_extractor, old_dim)
+                raise
+            
+            self.extractor = extractor
+            self.devices.clear()
+            self.devices.update(devices)
+            # _writing() rebuilds it if compact() moved rows after all
+            self.index, self._index_row_moves = index, row_moves
+        
+        if os.path.exists(old_vectors_path) and old_vectors_path != self.store.vectors_path:
+            os.remove(old_vectors_path)
+        print(f"Re-indexed {sum(len(d['images']) for d in devices.values())} images with {tag_of(extractor)}")
+        return True
+    
+    def _build_index(self, devices):
+        """In-memory feature index of a catalog's vectors in the feature store"""
+        index = FeatureIndex(self.store.dim, ann=create_ann_index(),
+                             prototype_top_k=config.PROTOTYPE_TOP_K, dtype=config.FEATURE_DTYPE)
+        for device_name, device_data in devices.items():
+            rows = [image["row"] for image in device_data["images"]]
+            index.add(device_name, self.store.get(rows), keys=rows)
+        # Center the approximate index on the whole catalog rather than the first device
+        index.rebuild_ann()
+        return index
+    
+    def _rebuild_index(self):
+        """Rebuild the in-memory feature index from the feature store"""
+        self.index = self._build_index(self.devices)
+        self._index_row_moves = self.store.row_moves
+        self.result_cache.invalidate()
     
     def save_devices(self):
-        """Save devices database"""
-        with open(self.devices_db_path, 'w') as f:
-            json.dump(self.devices, f, indent=2)
+        """Snapshot the devices database and compact the journal"""
+        with self._writing():
+            self.store.compact(self.devices)
+    
+    def _store_features(self, filenames, hashes, features_list):
+        """Append feature vectors to the store and return their image entries"""
+        rows = self.store.append(features_list)
+        return [{"file": filename, "hash": content_hash, "row": row}
+                for filename, content_hash, row in zip(filenames, hashes, rows)]
+    
+    def _index_entries(self, device_name, images, features_list, replace=False):
+        """Add a device's stored image entries to the feature index"""
+        rows = [image["row"] for image in images]
+        if replace:
+            self.index.replace(device_name, features_list, keys=rows)
+        else:
+            self.index.add(device_name, features_list, keys=rows)
     
     def extract_features(self, image):
-        """Extract simple features from image using OpenCV"""
+        """Extract features from image with the active feature extractor"""
         if isinstance(image, str):
             image = cv2.imread(image)
         
-        # Resize image
-        image = cv2.resize(image, config.TARGET_IMAGE_SIZE)
+        return self.extractor.extract(image)
+    
+    @staticmethod
+    def decode_image(image_data):
+        """Decode uploaded image bytes into a BGR image, or None if invalid"""
+        image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            # Formats OpenCV cannot decode (e.g. GIF) go through Pillow
+            try:
+                pil_image = Image.open(io.BytesIO(image_data)).convert('RGB')
+            except Exception:
+                return None
+            image = cv2.cvtColor(np.asarray(pil_image), cv2.COLOR_RGB2BGR)
+        return image
+    
+    def _query_scale(self, width, height):
+        """Smallest scale a query frame can be decoded at without changing what the features see"""
+        if config.RECOGNITION_MODE == "regions":
+            return config.ROI_IMAGE_SIZE / max(width, height)
+        if self.extractor.decode_size is None:
+            return 1.0
+        return max(self.extractor.decode_size[0] / width, self.extractor.decode_size[1] / height)
+    
+    def decode_query(self, image_data):
+        """Decode a frame to recognize, JPEGs at a reduced resolution when the features allow it
+        
+        Training photos are always decoded in full, they are also kept and shown in the web UI.
+        """
+        if config.REDUCED_DECODE:
+            image = decode_reduced(image_data, self._query_scale)
+            if image is not None:
+                return image
+        return self.decode_image(image_data)
+    
+    @staticmethod
+    def make_thumbnail(image):
+        """JPEG bytes of a BGR image scaled down to fit THUMBNAIL_SIZE"""
+        height, width = image.shape[:2]
+        scale = min(1.0, config.THUMBNAIL_SIZE / max(height, width))
+        if scale < 1.0:
+            image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+        return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, config.THUMBNAIL_JPEG_QUALITY])[1].tobytes()
+    
+    @staticmethod
+    def _thumbnail_path(device_name, filename):
+        """Where the thumbnail of a device photo is kept"""
+        return os.path.join(config.DEVICE_THUMBNAILS_DIR, device_name, os.path.splitext(filename)[0] + ".jpg")
+    
+    def thumbnail(self, device_name, filename):
+        """Path of a photo's thumbnail, created from the original if it has none yet
         
-        # Convert to different color spaces and extract features
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        Returns:
+            str: Thumbnail path, or None if the photo does not exist or can't be decoded
+        """
+        if device_name not in self.devices or os.path.basename(filename) != filename:
+            return None
+        thumbnail_path = self._thumbnail_path(device_name, filename)
+        if os.path.exists(thumbnail_path):
+            return thumbnail_path
         
-        # Calculate histograms
-        hist_gray = cv2.calcHist([gray], [0], None, [256], [0, 256])
-        hist_h = cv2.calcHist([hsv], [0], None, [180], [0, 180])
-        hist_s = cv2.calcHist([hsv], [1], None, [256], [0, 256])
+        # Photos from before thumbnails, or uploads whose features came from the store without decoding
+        image_path = os.path.join(config.DEVICE_PHOTOS_DIR, device_name, filename)
+        if not os.path.isfile(image_path):
+            return None
+        with open(image_path, 'rb') as f:
+            image = self.decode_image(f.read())
+        if image is None:
+            return None
+        self._write_thumbnail(thumbnail_path, self.make_thumbnail(image))
+        return thumbnail_path
+    
+    @staticmethod
+    def _write_thumbnail(thumbnail_path, data):
+        """Write a thumbnail atomically, concurrent requests may be creating the same one"""
+        os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+        temp_path = f"{thumbnail_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, thumbnail_path)
+    
+    def _process_upload(self, image_data, cached_features=None):
+        """Decode an uploaded image, extract its features and make its thumbnail
+        
+        Returns:
+            tuple: (features, file extension, bytes to write to disk, thumbnail JPEG bytes or None),
+                or None if invalid
+        """
+        # Keep JPEG and PNG uploads byte-for-byte, re-encode anything else as JPEG
+        ext = None
+        if image_data[:3] == b'\xff\xd8\xff':
+            ext = ".jpg"
+        elif image_data[:8] == b'\x89PNG\r\n\x1a\n':
+            ext = ".png"
+        
+        # Already seen this exact image, no need to decode it again (the thumbnail is made on first view)
+        if cached_features is not None and ext is not None:
+            return cached_features, ext, image_data, None
+        
+        image = self.decode_image(image_data)
+        if image is None:
+            return None
         
-        # Normalize histograms
-        hist_gray = cv2.normalize(hist_gray, hist_gray).flatten()
-        hist_h = cv2.normalize(hist_h, hist_h).flatten()
-        hist_s = cv2.normalize(hist_s, hist_s).flatten()
+        features = cached_features if cached_features is not None else self.extract_features(image)
+        thumbnail = self.make_thumbnail(image)
+        if ext is not None:
+            return features, ext, image_data, thumbnail
+        return features, ".jpg", cv2.imencode('.jpg', image)[1].tobytes(), thumbnail
+    
+    def extract_features_batch(self, image_datas):
+        """Decode uploaded images and extract their features on the worker pool
         
-        # Combine features
-        features = np.concatenate([hist_gray, hist_h, hist_s])
+        Returns:
+            list: features per upload, None for uploads that could not be decoded
+        """
+        def decode_and_extract(image_data):
+            image = self.decode_query(image_data)
+            return None if image is None else self.extract_features(image)
         
-        return features
+        return list(self.pool.map(decode_and_extract, image_datas))
     
-    def add_device(self, device_name, image_files):
-        """Add a new device with training images"""
-        device_dir = os.path.join(config.DEVICE_PHOTOS_DIR, device_name)
-        os.makedirs(device_dir, exist_ok=True)
+    def cached_result(self, image):
+        """Look up the recognition of a near-identical recent frame
+        
+        Returns:
+            tuple: (frame hash, cache generation, (device name, confidence) or None),
+                pass the first two to remember_result() after recognizing a miss
+        """
+        key = frame_hash(image)
+        generation, result = self.result_cache.get(key)
+        return key, generation, result
+    
+    def remember_result(self, key, generation, result):
+        """Cache a recognition for frames like this one"""
+        self.result_cache.put(key, result, generation)
+    
+    def recognize_uploads(self, image_datas, timer=None):
+        """Decode and recognize uploaded images, reusing results of near-identical recent frames
+        
+        Args:
+            image_datas (list): Raw uploaded image bytes
+            timer (callable): Optional timer(stage) context manager for the decode_extract and recognize stages,
+                in "regions" RECOGNITION_MODE frames are recognized during decode_extract
+        
+        Returns:
+            list: (device name, confidence) per upload, None for uploads that could not be decoded
+        """
+        timer = timer or (lambda stage: nullcontext())
+        
+        def decode_and_extract(image_data):
+            image = self.decode_query(image_data)
+            if image is None:
+                return None
+            key, generation, result = self.cached_result(image)
+            if result is None and config.RECOGNITION_MODE == "regions":
+                result = self.recognize_regions(image)
+                self.remember_result(key, generation, result)
+            features = self.extract_features(image) if result is None else None
+            return key, generation, result, features
+        
+        with timer("decode_extract"):
+            processed = list(self.pool.map(decode_and_extract, image_datas))
+        
+        misses = [i for i, item in enumerate(processed) if item is not None and item[2] is None]
+        results = [None if item is None else item[2] for item in processed]
+        if misses:
+            with timer("recognize"):
+                recognized = self.recognize_features([processed[i][3] for i in misses])
+            for i, result in zip(misses, recognized):
+                key, generation = processed[i][:2]
+                self.remember_result(key, generation, result)
+                results[i] = result
+        return results
+    
+    def _cached_features(self, hashes):
+        """Stored vectors for content hashes seen before, None for the rest"""
+        with self._reading():
+            rows = [self.store.cached_row(content_hash) for content_hash in hashes]
+            known = [row for row in rows if row is not None]
+            vectors = iter(self.store.get(known)) if known else iter(())
+        return [None if row is None else next(vectors) for row in rows]
+    
+    @staticmethod
+    def _image_number(filename):
+        """n of an image_<n> file name, None for other names"""
+        match = re.match(r'image_(\d+)\.', filename)
+        return int(match.group(1)) if match else None
+    
+    def _next_image_number(self, device_dir, device_name):
+        """First number for a device's next upload
+        
+        Every upload bumps the device's next_image counter in the catalog, so the
+        number of a deleted photo, the highest one included, is never given to a
+        new photo whose URL a browser may still have cached. Devices from before
+        the counter continue after the highest image_<n> on disk or in the catalog.
+        """
+        with self._reading():
+            device_data = self.devices.get(device_name) or {}
+            counter = device_data.get("next_image", 0)
+            filenames = [image["file"] for image in device_data.get("images", []) if image["file"]]
+        filenames += os.listdir(device_dir)
+        numbers = [number for number in map(self._image_number, filenames) if number is not None]
+        return max([counter] + [number + 1 for number in numbers])
+    
+    def _save_uploads(self, device_dir, image_datas):
+        """Extract features from uploads in parallel and save them as image_<n> files
+        
+        Files are created exclusively, a number taken by a concurrent upload to the
+        same device (another thread, worker process or background job) is skipped.
+        
+        Returns:
+            tuple: (filenames, content hashes, features_list)
+        """
+        hashes = [hashlib.sha1(image_data).hexdigest() for image_data in image_datas]
+        cached = self._cached_features(hashes)
+        processed = list(self.pool.map(self._process_upload, image_datas, cached))
+        for i, result in enumerate(processed):
+            if result is None:
+                raise ValueError(f"Image {i + 1} of {len(image_datas)} is not a valid image")
         
+        os.makedirs(device_dir, exist_ok=True)
+        filenames = []
         features_list = []
         
-        for i, image_file in enumerate(image_files):
+        device_name = os.path.basename(device_dir)
+        num = self._next_image_number(device_dir, device_name)
+        for features, ext, file_data, thumbnail in processed:
             # Save image
-            image_path = os.path.join(device_dir, f"image_{i}.jpg")
-            image_file.save(image_path)
-            
-            # Extract features
-            image = cv2.imread(image_path)
-            features = self.extract_features(image)
-            features_list.append(features.tolist())
+            while True:
+                filename = f"image_{num}{ext}"
+                num += 1
+                try:
+                    with open(os.path.join(device_dir, filename), 'xb') as f:
+                        f.write(file_data)
+                    break
+                except FileExistsError:
+                    continue
+            if thumbnail is not None:
+                self._write_thumbnail(self._thumbnail_path(device_name, filename), thumbnail)
+            filenames.append(filename)
+            features_list.append(features)
+        
+        return filenames, hashes, features_list
+    
+    def add_device(self, device_name, image_datas):
+        """Add a new device with training images (raw uploaded image bytes)"""
+        device_dir = os.path.join(config.DEVICE_PHOTOS_DIR, device_name)
+        filenames, hashes, features_list = self._save_uploads(device_dir, image_datas)
         
         # Store device info
-        self.devices[device_name] = {
-            "name": device_name,
-            "features": features_list,
-            "image_count": len(image_files)
-        }
-        
-        self.save_devices()
+        with self._writing():
+            images = self._store_features(filenames, hashes, features_list)
+            self.store.record(self.devices, "put_device", device_name, data={
+                "name": device_name,
+                "image_count": len(images),
+                "images": images,
+                "next_image": max(map(self._image_number, filenames), default=-1) + 1
+            })
+            self._index_entries(device_name, images, features_list, replace=True)
         return True
     
     def recognize_device(self, image):
@@ -84,94 +503,224 @@ class DeviceRecognizer:
         
         # Extract features from input image
         input_features = self.extract_features(image)
+        return self.recognize_features([input_features])[0]
+    
+    def recognize_features(self, features_list):
+        """Recognize the device for each of several feature vectors"""
+        if len(self.devices) == 0:
+            return [(None, 0)] * len(features_list)
         
-        best_match = None
-        best_similarity = 0
+        # Score every vector against every training vector at once, keeping the best per device
+        with self._lock:
+            names, scores = self.index.device_scores_batch(np.asarray(features_list))
         
-        # Compare with all devices
-        for device_name, device_data in self.devices.items():
-            device_features = device_data["features"]
-            
-            # Calculate similarity with each training image
-            similarities = []
-            for features in device_features:
-                similarity = cosine_similarity([input_features], [features])[0][0]
-                similarities.append(similarity)
+        results = []
+        for frame_scores in scores:
+            if len(names) == 0 or not np.isfinite(frame_scores.max()):
+                results.append((None, 0))
+                continue
             
-            # Use the maximum similarity
-            max_similarity = max(similarities)
+            best = int(np.argmax(frame_scores))
+            best_match, best_similarity = names[best], float(frame_scores[best])
             
-            if max_similarity > best_similarity:
-                best_similarity = max_similarity
-                best_match = device_name
+            # Return result if above threshold
+            if best_similarity >= config.SIMILARITY_THRESHOLD:
+                results.append((best_match, best_similarity))
+            else:
+                results.append((None, best_similarity))
+        return results
+    
+    def score_devices(self, features):
+        """Best similarity of one feature vector to each device, as {device name: score}"""
+        with self._lock:
+            return self.index.device_scores(features)
+    
+    @staticmethod
+    def best_match(scores):
+        """(device name, confidence) of the best {device name: score}, (None, best score) below the threshold"""
+        if not scores:
+            return None, 0
+        best_match = max(scores, key=scores.get)
+        if scores[best_match] >= config.SIMILARITY_THRESHOLD:
+            return best_match, scores[best_match]
+        return None, scores[best_match]
+    
+    def _score_windows(self, image):
+        """Best matching device of every window of a frame at several scales
         
-        # Return result if above threshold
-        if best_similarity >= config.SIMILARITY_THRESHOLD:
-            return best_match, best_similarity
+        Returns:
+            list: (device name, similarity, center-weighted score, [x, y, width, height]) per window,
+                best center-weighted score first, empty without devices
+        """
+        if len(self.devices) == 0:
+            return []
+        
+        height, width = image.shape[:2]
+        small, _ = resize_longest(image, config.ROI_IMAGE_SIZE)
+        windows = grid_windows(config.ROI_GRID, config.ROI_WINDOW_SIZES)
+        features = window_features(self.extractor, small, config.ROI_GRID, windows)
+        with self._lock:
+            names, scores = self.index.device_scores_batch(features)
+        if len(names) == 0:
+            return []
+        
+        best = np.argmax(scores, axis=1)
+        similarity = scores[np.arange(len(windows)), best]
+        weighted = similarity * center_weights(windows, config.ROI_GRID, config.ROI_CENTER_WEIGHT)
+        boxes = window_boxes(windows, config.ROI_GRID, width, height)
+        return [(names[best[i]], float(similarity[i]), float(weighted[i]), [int(value) for value in boxes[i]])
+                for i in np.argsort(-weighted)]
+    
+    def detect_devices(self, image):
+        """Find registered devices in a frame by scoring windows of it at several scales
+        
+        Every window is compared with the catalog, so a frame showing two devices or
+        a device in a cluttered room matches better than its global histogram would.
+        Windows near the center are preferred, that is where the user is looking.
+        
+        Returns:
+            list: {"device", "confidence", "score", "box": [x, y, width, height]} per device matched
+                by a window at or above SIMILARITY_THRESHOLD, best center-weighted score first
+        """
+        # Each device's best window, in order of center-weighted score
+        candidates = {}
+        for device_name, similarity, weighted, box in self._score_windows(image):
+            if similarity >= config.SIMILARITY_THRESHOLD and device_name not in candidates:
+                candidates[device_name] = {
+                    "device": device_name,
+                    "confidence": similarity,
+                    "score": weighted,
+                    "box": box
+                }
+        return list(candidates.values())
+    
+    def recognize_regions(self, image):
+        """(device name, confidence) of the best center-weighted window that matches
+        
+        Like recognize_device(), a miss returns None with the similarity the best
+        center-weighted window reached, so callers still see how close the frame came.
+        """
+        windows = self._score_windows(image)
+        for device_name, similarity, _, _ in windows:
+            if similarity >= config.SIMILARITY_THRESHOLD:
+                return device_name, similarity
+        return None, windows[0][1] if windows else 0
+    
+    def measure_ann_recall(self, samples=200, noise=0.05, seed=0):
+        """Recall of approximate search against the exact scan on perturbed training vectors"""
+        with self._lock:
+            queries = self.index.sample(samples, seed)
+            rng = np.random.default_rng(seed)
+            queries = np.clip(queries + rng.normal(0, noise, queries.shape), 0, None)
+            stats = self.index.measure_recall(queries)
+        if config.ANN_BACKEND:
+            stats["backend"] = config.ANN_BACKEND
+        elif self.index.approximate:
+            stats["backend"] = f"prototype top-{config.PROTOTYPE_TOP_K}"
         else:
-            return None, best_similarity
+            stats["backend"] = "exact"
+        return stats
+    
+    @staticmethod
+    def vote(results):
+        """Combine per-frame (device, confidence) results into one majority decision"""
+        votes = {}
+        for device_name, confidence in results:
+            if device_name is not None:
+                votes.setdefault(device_name, []).append(confidence)
+        
+        if not votes:
+            return None, max((confidence for _, confidence in results), default=0), 0
+        
+        # Most votes wins, ties broken by mean confidence
+        winner = max(votes, key=lambda name: (len(votes[name]), np.mean(votes[name])))
+        return winner, float(np.mean(votes[winner])), len(votes[winner])
     
     def get_devices_list(self):
         """Get list of all registered devices"""
-        return [{"name": name, "image_count": data["image_count"]} 
-                for name, data in self.devices.items()]
+        with self._lock:
+            return [{"name": name, "image_count": data["image_count"]}
+                    for name, data in self.devices.items()]
     
     def delete_device(self, device_name):
         """Delete a device and its images"""
-        if device_name in self.devices:
-            # Remove from database
-            del self.devices[device_name]
-            self.save_devices()
+        with self._writing():
+            if device_name not in self.devices:
+                return False
             
-            # Remove image directory
-            device_dir = os.path.join(config.DEVICE_PHOTOS_DIR, device_name)
+            # Remove from database
+            self.store.record(self.devices, "delete_device", device_name)
+            self.index.remove(device_name)
+        
+        # Remove image and thumbnail directories
+        for photos_dir in (config.DEVICE_PHOTOS_DIR, config.DEVICE_THUMBNAILS_DIR):
+            device_dir = os.path.join(photos_dir, device_name)
             if os.path.exists(device_dir):
-                import shutil
                 shutil.rmtree(device_dir)
-            
-            return True
-        return False
-    
-    def get_device_details(self, device_name):
-        """Get detailed information about a specific device"""
-        if device_name not in self.devices:
-            return None
         
-        device_dir = os.path.join(config.DEVICE_PHOTOS_DIR, device_name)
-        image_files = []
+        return True
+    
+    def get_device_details(self, device_name, page=1, per_page=None):
+        """Get detailed information about a specific device
+        
+        Photos come from the catalog rather than a directory listing, one page of them at a time.
+        
+        Args:
+            device_name (str): Name of the device
+            page (int): 1-based page of photos
+            per_page (int): Photos per page, all of them if None
+        
+        Returns:
+            dict: name, image_count, images ({"file", "version"} dicts, version changes with the
+                photo's content), page and pages, or None for unknown devices
+        """
+        with self._lock:
+            if device_name not in self.devices:
+                return None
+            image_count = self.devices[device_name]["image_count"]
+            entries = list(self.devices[device_name].get("images", []))
+        
+        images = [{"file": entry["file"], "version": (entry.get("hash") or "")[:12]} for entry in entries]
+        if any(entry["file"] is None for entry in entries):
+            # Migrated devices whose photos couldn't be paired with their vectors
+            device_dir = os.path.join(config.DEVICE_PHOTOS_DIR, device_name)
+            filenames = sorted(os.listdir(device_dir)) if os.path.exists(device_dir) else []
+            images = [{"file": filename, "version": ""} for filename in filenames
+                      if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif'))]
         
-        if os.path.exists(device_dir):
-            for filename in os.listdir(device_dir):
-                if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                    image_files.append(filename)
+        per_page = per_page or max(len(images), 1)
+        pages = max(1, -(-len(images) // per_page))
+        page = min(max(page, 1), pages)
         
         return {
             "name": device_name,
-            "image_count": self.devices[device_name]["image_count"],
-            "images": sorted(image_files)
+            "image_count": image_count,
+            "images": images[(page - 1) * per_page:page * per_page],
+            "page": page,
+            "pages": pages
         }
     
     def update_device_name(self, old_name, new_name):
         """Update device name"""
-        if old_name not in self.devices:
-            return False
-        
-        if new_name != old_name and new_name in self.devices:
-            return False  # New name already exists
-        
-        # Update database
-        self.devices[new_name] = self.devices[old_name]
-        self.devices[new_name]["name"] = new_name
-        del self.devices[old_name]
-        
-        # Rename directory
-        old_dir = os.path.join(config.DEVICE_PHOTOS_DIR, old_name)
-        new_dir = os.path.join(config.DEVICE_PHOTOS_DIR, new_name)
-        
-        if os.path.exists(old_dir):
-            os.rename(old_dir, new_dir)
+        with self._writing():
+            if old_name not in self.devices:
+                return False
+            
+            if new_name != old_name and new_name in self.devices:
+                return False  # New name already exists
+            
+            # Update database
+            self.store.record(self.devices, "rename", old_name, new_name=new_name)
+            self.index.rename(old_name, new_name)
+            
+            # Rename image and thumbnail directories
+            for photos_dir in (config.DEVICE_PHOTOS_DIR, config.DEVICE_THUMBNAILS_DIR):
+                old_dir = os.path.join(photos_dir, old_name)
+                new_dir = os.path.join(photos_dir, new_name)
+                
+                if os.path.exists(old_dir):
+                    os.rename(old_dir, new_dir)
         
-        self.save_devices()
         return True
     
     def delete_device_image(self, device_name, image_filename):
@@ -184,61 +733,86 @@ class DeviceRecognizer:
         
         if os.path.exists(image_path):
             os.remove(image_path)
+            thumbnail_path = self._thumbnail_path(device_name, image_filename)
+            if os.path.exists(thumbnail_path):
+                os.remove(thumbnail_path)
+            
+            with self._writing():
+                images = self.devices.get(device_name, {}).get("images", [])
+                entry = next((image for image in images if image["file"] == image_filename), None)
+                if entry is not None:
+                    # Drop just this image's vector
+                    self.store.record(self.devices, "remove_image", device_name, file=image_filename)
+                    self.index.remove_keys([entry["row"]])
+                    return True
             
-            # Recalculate features for remaining images
+            # Image is not tracked individually, recalculate features for remaining images
             self._recalculate_device_features(device_name)
             return True
         
         return False
     
-    def add_device_images(self, device_name, image_files):
-        """Add new images to an existing device"""
+    def add_device_images(self, device_name, image_datas):
+        """Add new images (raw uploaded image bytes) to an existing device"""
         if device_name not in self.devices:
             return False
         
         device_dir = os.path.join(config.DEVICE_PHOTOS_DIR, device_name)
-        os.makedirs(device_dir, exist_ok=True)
-        
-        # Find next available image number
-        existing_files = [f for f in os.listdir(device_dir) if f.startswith('image_')]
-        next_num = len(existing_files)
-        
-        features_list = self.devices[device_name]["features"]
-        
-        for i, image_file in enumerate(image_files):
-            # Save image
-            image_path = os.path.join(device_dir, f"image_{next_num + i}.jpg")
-            image_file.save(image_path)
-            
-            # Extract features
-            image = cv2.imread(image_path)
-            features = self.extract_features(image)
-            features_list.append(features.tolist())
+        filenames, hashes, new_features = self._save_uploads(device_dir, image_datas)
         
         # Update device info
-        self.devices[device_name]["features"] = features_list
-        self.devices[device_name]["image_count"] = len(features_list)
-        
-        self.save_devices()
+        with self._writing():
+            if device_name not in self.devices:
+                return False  # Deleted or renamed while the upload was processed
+            images = self._store_features(filenames, hashes, new_features)
+            self.store.record(self.devices, "add_images", device_name, images=images,
+                              next_image=max(map(self._image_number, filenames), default=-1) + 1)
+            self._index_entries(device_name, images, new_features)
         return True
     
     def _recalculate_device_features(self, device_name):
-        """Recalculate features for all images of a device"""
+        """Recalculate features for all images of a device
+        
+        Only photos that are new or changed since they were last indexed are
+        decoded, the rest are looked up by content hash in the feature store.
+        """
         device_dir = os.path.join(config.DEVICE_PHOTOS_DIR, device_name)
+        filenames = []
+        hashes = []
         features_list = []
         
         if os.path.exists(device_dir):
-            image_files = [f for f in os.listdir(device_dir) 
+            image_files = [f for f in os.listdir(device_dir)
                           if f.lower().endswith(('.jpg', '.jpeg', '.png', '.gif'))]
             
-            for image_file in image_files:
-                image_path = os.path.join(device_dir, image_file)
-                image = cv2.imread(image_path)
-                if image is not None:
-                    features = self.extract_features(image)
-                    features_list.append(features.tolist())
+            def read_and_hash(image_file):
+                with open(os.path.join(device_dir, image_file), 'rb') as f:
+                    image_data = f.read()
+                return image_data, hashlib.sha1(image_data).hexdigest()
+            
+            read = list(self.pool.map(read_and_hash, image_files))
+            cached = self._cached_features([content_hash for _, content_hash in read])
+            
+            def extract(image_data, cached_features):
+                if cached_features is not None:
+                    return cached_features
+                image = self.decode_image(image_data)
+                return None if image is None else self.extract_features(image)
+            
+            extracted = self.pool.map(extract, [image_data for image_data, _ in read], cached)
+            for image_file, (_, content_hash), features in zip(image_files, read, extracted):
+                if features is not None:
+                    filenames.append(image_file)
+                    hashes.append(content_hash)
+                    features_list.append(features)
         
         # Update device info
-        self.devices[device_name]["features"] = features_list
-        self.devices[device_name]["image_count"] = len(features_list)
-        self.save_devices()
+        with self._writing():
+            images = self._store_features(filenames, hashes, features_list)
+            self.store.record(self.devices, "put_device", device_name, data={
+                "name": device_name,
+                "image_count": len(images),
+                "images": images,
+                "next_image": self.devices.get(device_name, {}).get("next_image", 0)
+            })
+            self._index_entries(device_name, images, features_list, replace=True)
@@ -0,0 +1,83 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AutomationDispatcher:
+    """Runs automation module commands off the request thread
+
+    Commands go through a single worker thread, so they reach the hub in the
+    order they were recognized. Results of queued commands are only logged and
+    counted, the client gets an immediate "queued" answer instead.
+
+    Commands queued while the worker is busy are sent together, through the
+    module's execute_commands(commands) if it has one (e.g. Home Assistant
+    combines them into one service call per action).
+    """
+
+    def __init__(self, module, module_name, metrics=None):
+        self.module = module
+        self.module_name = module_name
+        self.metrics = metrics
+        self._pending = []      # (device_name, action) queued but not sent yet
+        self._pending_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def after_fork(self):
+        """Re-create the worker thread in a forked server process"""
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def execute_many(self, commands, breakdown=None):
+        """Execute (device_name, action) commands now and return the module's result dicts"""
+        start = time.perf_counter()
+        try:
+            if len(commands) > 1 and hasattr(self.module, "execute_commands"):
+                results = self.module.execute_commands(commands)
+            else:
+                results = [self.module.execute_command(device_name, action) for device_name, action in commands]
+        except Exception as e:
+            results = [{
+                "success": False,
+                "message": f"Error controlling {device_name}: {e}",
+                "device": device_name,
+                "action": action
+            } for device_name, action in commands]
+        elapsed = time.perf_counter() - start
+
+        if self.metrics is not None:
+            self.metrics.stage_seconds.observe(elapsed, stage="execute")
+            failed = sum(not result.get("success", False) for result in results)
+            if failed:
+                self.metrics.automation_errors.inc(failed, module=self.module_name)
+        if breakdown is not None:
+            breakdown["execute"] = round(elapsed * 1000, 3)
+        return results
+
+    def execute(self, device_name, action, breakdown=None):
+        """Execute a command now and return the module's result dict"""
+        return self.execute_many([(device_name, action)], breakdown)[0]
+
+    def submit(self, device_name, action):
+        """Queue a command and return a placeholder result right away"""
+        with self._pending_lock:
+            self._pending.append((device_name, action))
+        self._executor.submit(self._flush)
+        return {
+            "success": True,
+            "queued": True,
+            "message": f"Turning {device_name} {action}",
+            "device": device_name,
+            "action": action
+        }
+
+    def _flush(self):
+        """Send every queued command, nothing left if an earlier flush already took them"""
+        with self._pending_lock:
+            commands, self._pending = self._pending, []
+        if not commands:
+            return
+        for (device_name, action), result in zip(commands, self.execute_many(commands)):
+            if not result.get("success", False):
+                print(f"Queued command {device_name} -> {action} failed: {result.get('message')}")
@@ -0,0 +1,364 @@
+import numpy as np
+
+# Supported storage types of the training vectors: bytes per element 4, 2 and 1
+DTYPES = ("float32", "float16", "uint8")
+
+
+class FeatureIndex:
+    """In-memory index of L2-normalized training vectors grouped by device
+
+    Vectors are kept as float32, float16 or uint8. uint8 rows are quantized
+    affinely, value = code * scale + offset with one scale and offset per row.
+    Scoring converts chunk_rows rows at a time to float32 for the matrix
+    product, so the full-precision copy never exists at once.
+    """
+
+    def __init__(self, dim=None, ann=None, prototype_top_k=0, dtype="float32", chunk_rows=4096):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown feature dtype '{dtype}', available: {', '.join(DTYPES)}")
+        self.dim = dim
+        self.ann = ann      # optional approximate candidate generator (see ann_index.py)
+        self.prototype_top_k = prototype_top_k  # rescore only this many devices, 0 scans them all
+        self.dtype = np.dtype(dtype)
+        self.chunk_rows = chunk_rows
+        self._matrix = np.empty((0, dim or 0), dtype=self.dtype)
+        # uint8 only: per-row dequantization parameters
+        self._scales = np.empty(0, dtype=np.float32)
+        self._offsets = np.empty(0, dtype=np.float32)
+        self._labels = np.empty(0, dtype=np.int32)
+        self._keys = np.empty(0, dtype=np.int64)   # caller-supplied key per row, -1 if none
+        self._size = 0      # rows in use (live + dead)
+        self._dead = 0      # rows freed by remove(), reclaimed by compact()
+        self._names = []    # label id -> device name (None once freed)
+        self._ids = {}      # device name -> label id
+        self._positions = {}    # key -> row position
+        # Running sum and count of each device's vectors, their mean is the device prototype. Only
+        # prototype prefiltering reads the sums, without it they are kept zero-width to save memory
+        self._keep_sums = prototype_top_k > 0
+        self._sums = np.zeros((0, self._sum_dim), dtype=np.float64)
+        self._counts = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return self._size - self._dead
+
+    @property
+    def nbytes(self):
+        """Memory held by the index arrays"""
+        return (self._matrix.nbytes + self._scales.nbytes + self._offsets.nbytes + self._labels.nbytes
+                + self._keys.nbytes + self._sums.nbytes + self._counts.nbytes)
+
+    @staticmethod
+    def normalize(vectors):
+        """L2-normalize vectors row-wise as contiguous float32"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[np.newaxis, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return np.ascontiguousarray(vectors / norms)
+
+    @property
+    def _sum_dim(self):
+        return (self.dim or 0) if self._keep_sums else 0
+
+    @property
+    def quantized(self):
+        return self.dtype == np.uint8
+
+    def _encode(self, vectors):
+        """Storage form of normalized float32 vectors: (rows, scales, offsets)"""
+        if not self.quantized:
+            return vectors.astype(self.dtype), None, None
+        low = vectors.min(axis=1)
+        scales = (vectors.max(axis=1) - low) / 255
+        scales[scales == 0] = 1.0
+        codes = np.rint((vectors - low[:, np.newaxis]) / scales[:, np.newaxis])
+        return codes.astype(np.uint8), scales.astype(np.float32), low.astype(np.float32)
+
+    def _decode(self, rows):
+        """float32 training vectors of a row slice or index array"""
+        vectors = self._matrix[rows].astype(np.float32, copy=False)
+        if self.quantized:
+            vectors = vectors * self._scales[rows, np.newaxis] + self._offsets[rows, np.newaxis]
+        return vectors
+
+    def _label_for(self, device_name):
+        """Get or allocate the label id of a device"""
+        label = self._ids.get(device_name)
+        if label is None:
+            label = len(self._names)
+            self._names.append(device_name)
+            self._ids[device_name] = label
+        return label
+
+    def _reserve(self, rows):
+        """Grow the backing arrays so that `rows` more rows fit"""
+        needed = self._size + rows
+        capacity = self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 64)
+        matrix = np.zeros((capacity, self.dim), dtype=self.dtype)
+        matrix[:self._size] = self._matrix[:self._size]
+        if self.quantized:
+            scales = np.zeros(capacity, dtype=np.float32)
+            scales[:self._size] = self._scales[:self._size]
+            offsets = np.zeros(capacity, dtype=np.float32)
+            offsets[:self._size] = self._offsets[:self._size]
+            self._scales, self._offsets = scales, offsets
+        labels = np.full(capacity, -1, dtype=np.int32)
+        labels[:self._size] = self._labels[:self._size]
+        keys = np.full(capacity, -1, dtype=np.int64)
+        keys[:self._size] = self._keys[:self._size]
+        self._matrix, self._labels, self._keys = matrix, labels, keys
+
+    def add(self, device_name, vectors, keys=None):
+        """Append training vectors for a device, optionally tagged with unique integer keys"""
+        vectors = self.normalize(vectors)
+        if vectors.size == 0:   # [] normalizes to shape (1, 0)
+            self._label_for(device_name)
+            return
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._matrix = np.empty((0, self.dim), dtype=self.dtype)
+            self._sums = np.zeros((0, self._sum_dim), dtype=np.float64)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dim features, got {vectors.shape[1]}")
+
+        label = self._label_for(device_name)
+        self._reserve(len(vectors))
+        start, end = self._size, self._size + len(vectors)
+        codes, scales, offsets = self._encode(vectors)
+        self._matrix[start:end] = codes
+        if self.quantized:
+            self._scales[start:end] = scales
+            self._offsets[start:end] = offsets
+        self._labels[start:end] = label
+        if keys is not None:
+            self._keys[start:end] = keys
+            for position, key in enumerate(keys, start):
+                self._positions[int(key)] = position
+        self._size = end
+        self._grow_prototypes()
+        if self._keep_sums:
+            self._sums[label] += vectors.sum(axis=0)
+        self._counts[label] += len(vectors)
+        if self.ann is not None:
+            self.ann.insert(np.arange(start, end), vectors)
+
+    def _grow_prototypes(self):
+        """Make room in the prototype arrays for every allocated label"""
+        labels = len(self._names)
+        if self.dim is None or labels <= len(self._counts):
+            return
+        capacity = max(labels, len(self._counts) * 2, 16)
+        sums = np.zeros((capacity, self._sum_dim), dtype=np.float64)
+        sums[:len(self._sums)] = self._sums
+        counts = np.zeros(capacity, dtype=np.int64)
+        counts[:len(self._counts)] = self._counts
+        self._sums, self._counts = sums, counts
+
+    def remove(self, device_name):
+        """Drop a device and all of its training vectors"""
+        label = self._ids.pop(device_name, None)
+        if label is None:
+            return
+        self._names[label] = None
+        if label < len(self._counts):
+            # Reset instead of subtracting so no rounding residue is left behind
+            self._sums[label] = 0
+            self._counts[label] = 0
+        rows = np.flatnonzero(self._labels[:self._size] == label)
+        self._free_rows(rows, update_prototypes=False)
+
+    def remove_keys(self, keys):
+        """Drop individual training vectors by the keys they were added with"""
+        rows = [self._positions.pop(int(key)) for key in keys if int(key) in self._positions]
+        self._free_rows(np.asarray(rows, dtype=np.int64))
+
+    def _free_rows(self, rows, update_prototypes=True):
+        """Tombstone rows and compact once more than half of the index is dead"""
+        for key in self._keys[rows]:
+            self._positions.pop(int(key), None)
+        if self.ann is not None:
+            self.ann.remove(rows)
+        if update_prototypes:
+            labels = self._labels[rows]
+            if self._keep_sums:
+                np.subtract.at(self._sums, labels, self._decode(rows).astype(np.float64))
+            np.subtract.at(self._counts, labels, 1)
+        self._labels[rows] = -1
+        self._keys[rows] = -1
+        self._matrix[rows] = 0
+        if self.quantized:
+            self._scales[rows] = 0
+            self._offsets[rows] = 0
+        self._dead += len(rows)
+        if self._dead > self._size // 2:
+            self.compact()
+
+    def keys(self):
+        """{device name: set of keys} of the live training vectors that were added with keys"""
+        keys = {name: set() for name in self._ids}
+        for key, position in self._positions.items():
+            keys[self._names[self._labels[position]]].add(key)
+        return keys
+
+    def replace(self, device_name, vectors, keys=None):
+        """Replace all training vectors of a device"""
+        self.remove(device_name)
+        self.add(device_name, vectors, keys)
+
+    def rename(self, old_name, new_name):
+        """Rename a device without touching its vectors"""
+        label = self._ids.pop(old_name, None)
+        if label is None:
+            return
+        self._names[label] = new_name
+        self._ids[new_name] = label
+
+    def compact(self):
+        """Reclaim rows and label ids freed by remove()"""
+        live = self._labels[:self._size] >= 0
+        remap = np.full(len(self._names) + 1, -1, dtype=np.int32)
+        names = [name for name in self._names if name is not None]
+        for new_label, name in enumerate(names):
+            remap[self._ids[name]] = new_label
+        self._grow_prototypes()
+        old_labels = [self._ids[name] for name in names]
+        self._sums = self._sums[old_labels]
+        self._counts = self._counts[old_labels]
+
+        self._matrix = np.ascontiguousarray(self._matrix[:self._size][live])
+        if self.quantized:
+            self._scales = self._scales[:self._size][live]
+            self._offsets = self._offsets[:self._size][live]
+        self._labels = remap[self._labels[:self._size][live]]
+        self._keys = self._keys[:self._size][live]
+        self._size = len(self._labels)
+        self._positions = {int(key): position for position, key in enumerate(self._keys) if key >= 0}
+        self._dead = 0
+        self._names = names
+        self._ids = {name: label for label, name in enumerate(names)}
+        self.rebuild_ann()
+
+    def rebuild_ann(self):
+        """Re-insert every row into the approximate index, e.g. after a bulk load"""
+        if self.ann is not None:
+            self.ann.rebuild(self._decode(slice(0, self._size)))
+            self.ann.remove(np.flatnonzero(self._labels[:self._size] < 0))
+
+    def _best_per_device(self, rows, queries, best):
+        """Fold the similarities of `rows` to `queries` into best[label, query] by max"""
+        if isinstance(rows, slice):
+            start, stop, _ = rows.indices(self._size)
+            chunks = (slice(first, min(first + self.chunk_rows, stop)) for first in range(start, stop, self.chunk_rows))
+        else:
+            chunks = (rows[first:first + self.chunk_rows] for first in range(0, len(rows), self.chunk_rows))
+
+        query_sums = queries.sum(axis=1) if self.quantized else None
+        for chunk in chunks:
+            if self.quantized:
+                # (codes * scale + offset) . q == scale * (codes . q) + offset * sum(q)
+                sims = self._matrix[chunk].astype(np.float32) @ queries.T
+                sims = sims * self._scales[chunk, np.newaxis] + self._offsets[chunk, np.newaxis] * query_sums
+            else:
+                sims = self._matrix[chunk].astype(np.float32, copy=False) @ queries.T
+            labels = self._labels[chunk]
+            live = labels >= 0
+            np.maximum.at(best, labels[live], sims[live])
+
+    def device_scores_batch(self, queries, exact=False):
+        """Return (device names, best similarity matrix of shape (queries, devices))
+
+        With an ANN backend only its candidate rows are scored unless `exact` is set.
+        """
+        queries = self.normalize(queries)
+        names = [name for name in self._names if name is not None]
+        if len(self) == 0:
+            return names, np.full((len(queries), len(names)), -np.inf, dtype=np.float32)
+
+        best = np.full((len(self._names), len(queries)), -np.inf, dtype=np.float32)
+        if exact or not self.approximate:
+            # One matrix-matrix product scores every frame against every training vector
+            self._best_per_device(slice(0, self._size), queries, best)
+        else:
+            for i, rows in enumerate(self._candidate_rows(queries)):
+                self._best_per_device(rows, queries[i:i + 1], best[:, i:i + 1])
+
+        keep = [label for label, name in enumerate(self._names) if name is not None]
+        return names, best[keep].T
+
+    @property
+    def approximate(self):
+        """Whether queries only score a candidate subset of the rows"""
+        return self.ann is not None or 0 < self.prototype_top_k < len(self._ids)
+
+    def prototypes(self):
+        """L2-normalized mean vector per label, zero for labels without vectors"""
+        self._grow_prototypes()
+        sums = self._sums[:len(self._names)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (sums / norms).astype(np.float32)
+
+    def _candidate_rows(self, queries):
+        """Rows worth scoring exactly for each query"""
+        if self.ann is not None:
+            for query in queries:
+                rows = self.ann.candidates(query)
+                if len(rows) == 0:
+                    rows = slice(0, self._size)  # Nothing in the query's buckets, fall back to a full scan
+                yield rows
+            return
+
+        # Score device prototypes first, then only the top-K devices' training vectors
+        proto_scores = self.prototypes() @ queries.T
+        proto_scores[self._counts[:len(self._names)] == 0] = -np.inf
+        k = min(self.prototype_top_k, len(self._names))
+        labels = self._labels[:self._size]
+        for i in range(len(queries)):
+            top = np.argpartition(-proto_scores[:, i], k - 1)[:k]
+            yield np.flatnonzero(np.isin(labels, top))
+
+    def sample(self, count, seed=0):
+        """Random sample of live training vectors"""
+        live = np.flatnonzero(self._labels[:self._size] >= 0)
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(live, size=min(count, len(live)), replace=False)
+        return self._decode(rows)
+
+    def measure_recall(self, queries):
+        """Compare approximate (ANN or prototype prefiltered) results with the exact scan
+
+        Returns:
+            dict: fraction of queries whose best device matches the exact scan
+                  and the mean fraction of rows scored per query
+        """
+        queries = self.normalize(queries)
+        if not self.approximate or len(self) == 0 or len(queries) == 0:
+            return {"queries": len(queries), "recall": 1.0, "candidate_fraction": 1.0}
+
+        _, exact_scores = self.device_scores_batch(queries, exact=True)
+        _, ann_scores = self.device_scores_batch(queries)
+        candidates = [self._size if isinstance(rows, slice) else len(rows)
+                      for rows in self._candidate_rows(queries)]
+
+        return {
+            "queries": len(queries),
+            "recall": float(np.mean(exact_scores.argmax(axis=1) == ann_scores.argmax(axis=1))),
+            "candidate_fraction": float(np.mean(candidates) / len(self))
+        }
+
+    def device_scores(self, query):
+        """Return the best cosine similarity of the query against each device"""
+        names, scores = self.device_scores_batch(query)
+        return {name: float(score) for name, score in zip(names, scores[0]) if np.isfinite(score)}
+
+    def search(self, query):
+        """Return (device_name, similarity) of the closest device"""
+        scores = self.device_scores(query)
+        if not scores:
+            return None, 0
+        best_match = max(scores, key=scores.get)
+        return best_match, scores[best_match]
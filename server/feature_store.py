@@ -0,0 +1,408 @@
+import json
+import os
+import re
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None    # No advisory locks (Windows), only single-process serving is safe
+
+
+def _natural_key(filename):
+    """Sort key that orders image_2.jpg before image_10.jpg"""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', filename)]
+
+
+def _atomic_write(path, data):
+    """Write bytes to path via a temp file and rename so readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _file_signature(path):
+    """Identity of a file's current contents, None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def apply_entry(devices, entry):
+    """Apply one journal entry to the device catalog"""
+    op = entry["op"]
+    device_name = entry["device"]
+
+    if op == "put_device":
+        devices[device_name] = entry["data"]
+    elif op == "add_images":
+        images = devices[device_name]["images"]
+        images.extend(entry["images"])
+        devices[device_name]["image_count"] = len(images)
+        if "next_image" in entry:
+            devices[device_name]["next_image"] = max(devices[device_name].get("next_image", 0), entry["next_image"])
+    elif op == "remove_image":
+        images = [image for image in devices[device_name]["images"] if image["file"] != entry["file"]]
+        devices[device_name]["images"] = images
+        devices[device_name]["image_count"] = len(images)
+    elif op == "rename":
+        new_name = entry["new_name"]
+        devices[new_name] = devices.pop(device_name)
+        devices[new_name]["name"] = new_name
+    elif op == "delete_device":
+        devices.pop(device_name, None)
+    else:
+        raise ValueError(f"Unknown journal operation: {op}")
+
+
+class FeatureStore:
+    """Append-only binary file of float32 training vectors plus a journaled device catalog
+
+    The vectors file is a headerless row-major float32 array that is memory-mapped
+    on load. Vectors stay cached by image content hash until compaction, so
+    re-indexing a device only extracts features for new or changed photos. The catalog, where every training image references its vector by row
+    number, is persisted as a snapshot plus an append-only journal of mutations,
+    so an edit costs one journal line instead of a full rewrite. Compaction folds
+    the journal into a new snapshot and drops vectors no image refers to anymore.
+
+    Several processes (e.g. gunicorn workers) may share one store: writers hold
+    locked(exclusive=True) and readers locked() while touching the files, and
+    changed_on_disk()/tail() let a process catch up with edits made by the others.
+    """
+
+    def __init__(self, vectors_path, metadata_path, journal_path, compact_every=200):
+        self.vectors_path = vectors_path
+        self.metadata_path = metadata_path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self.dim = None
+        self.extractor = None       # tag of the feature extractor that produced the vectors
+        self.seq = 0                # sequence number of the last applied mutation
+        self.journal_entries = 0    # mutations recorded since the last snapshot
+        self.hash_rows = {}         # image content hash -> row, persisted through the catalog
+        self.journal_offset = 0     # bytes of the journal already applied
+        self.row_moves = 0          # bumped whenever compaction renumbers the rows of the catalog
+        self.lock_path = f"{metadata_path}.lock"
+        self._snapshot = None       # signature of the snapshot file as last loaded or saved
+        self._lock_file = None
+        self._lock_depth = 0
+        self._vectors = None
+
+    @contextmanager
+    def locked(self, exclusive=False):
+        """Hold a cross-process lock on the store files (shared for readers, exclusive for writers)
+
+        Re-entrant, but not thread-safe: threads of one process must serialize
+        around it themselves. A nested block keeps the outermost lock mode.
+        """
+        if self._lock_depth == 0 and fcntl is not None:
+            self._lock_file = open(self.lock_path, 'a')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        self._lock_depth += 1
+        try:
+            yield
+        finally:
+            self._lock_depth -= 1
+            if self._lock_depth == 0 and self._lock_file is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                self._lock_file.close()
+                self._lock_file = None
+
+    def after_fork(self):
+        """Forget lock state inherited from the parent process"""
+        self._lock_file = None
+        self._lock_depth = 0
+        self._vectors = None
+
+    @property
+    def row_count(self):
+        """Number of rows written to the vectors file"""
+        if self.dim is None or not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // (self.dim * 4)
+
+    def load(self):
+        """Load the latest snapshot, replay the journal and memory-map the vectors file"""
+        devices = {}
+        if os.path.exists(self.metadata_path):
+            with open(self.metadata_path, 'r') as f:
+                metadata = json.load(f)
+            self.dim = metadata.get("dim")
+            self.extractor = metadata.get("extractor")
+            self.seq = metadata.get("seq", 0)
+            if metadata.get("vectors"):
+                self.vectors_path = os.path.join(os.path.dirname(self.metadata_path), metadata["vectors"])
+            devices = metadata.get("devices", {})
+        self._snapshot = _file_signature(self.metadata_path)
+
+        self.hash_rows = {}
+        self._remember_hashes(image for device_data in devices.values() for image in device_data["images"])
+        self.journal_entries = self._replay(devices)
+        self._vectors = None
+        return devices
+
+    def _remember_hashes(self, images):
+        """Add image entries to the content hash cache"""
+        for image in images:
+            if image.get("hash"):
+                self.hash_rows[image["hash"]] = image["row"]
+
+    def _remember_entry(self, entry):
+        """Add the images introduced by a journal entry to the content hash cache"""
+        if entry["op"] == "put_device":
+            self._remember_hashes(entry["data"]["images"])
+        elif entry["op"] == "add_images":
+            self._remember_hashes(entry["images"])
+
+    def cached_row(self, content_hash):
+        """Row holding the vector already extracted for an image with this content hash"""
+        return self.hash_rows.get(content_hash)
+
+    def apply(self, devices, entry):
+        """Apply a journal entry that was written to the journal to `devices` and the store state"""
+        apply_entry(devices, entry)
+        self._remember_entry(entry)
+        self.seq = entry["seq"]
+        self.dim = entry.get("dim", self.dim)
+        self.extractor = entry.get("extractor", self.extractor)
+
+    def _replay(self, devices):
+        """Apply journal entries newer than the snapshot and return how many were applied"""
+        self.journal_offset = 0
+        if not os.path.exists(self.journal_path):
+            return 0
+
+        applied = 0
+        good_bytes = 0
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn write from a crash: everything from here on is discarded
+                    break
+                good_bytes += len(line)
+                if entry["seq"] <= self.seq:
+                    continue
+                self.apply(devices, entry)
+                applied += 1
+
+        if good_bytes != os.path.getsize(self.journal_path):
+            with open(self.journal_path, 'ab') as f:
+                f.truncate(good_bytes)
+        self.journal_offset = good_bytes
+        return applied
+
+    def changed_on_disk(self):
+        """Whether another process wrote a snapshot or journal entries since we last looked"""
+        journal = _file_signature(self.journal_path)
+        journal_size = journal[1] if journal else 0
+        return _file_signature(self.metadata_path) != self._snapshot or journal_size != self.journal_offset
+
+    def tail(self):
+        """Journal entries appended by other processes since we last looked
+
+        The caller applies them with apply(). Returns None when the snapshot was
+        replaced (compaction or re-index), the caller has to load() the store again.
+        """
+        if _file_signature(self.metadata_path) != self._snapshot:
+            return None
+        if not os.path.exists(self.journal_path):
+            return []
+        if os.path.getsize(self.journal_path) < self.journal_offset:
+            return None
+
+        entries = []
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self.journal_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break   # Still being written, picked up next time
+                self.journal_offset += len(line)
+                entry = json.loads(line)
+                if entry["seq"] > self.seq:
+                    entries.append(entry)
+        self.journal_entries += len(entries)
+        return entries
+
+    def record(self, devices, op, device_name, **fields):
+        """Durably journal a catalog mutation, then apply it to `devices`
+
+        May compact the store, see compact() for the rows this can move.
+        """
+        entry = {"seq": self.seq + 1, "op": op, "device": device_name,
+                 "dim": self.dim, "extractor": self.extractor}
+        entry.update(fields)
+        line = (json.dumps(entry) + "\n").encode()
+
+        with open(self.journal_path, 'ab') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.journal_offset += len(line)
+        self.apply(devices, entry)
+        self.journal_entries += 1
+
+        if self.journal_entries >= self.compact_every:
+            self.compact(devices)
+
+    def save(self, devices):
+        """Atomically write a snapshot of the catalog and reset the journal"""
+        metadata = {
+            "seq": self.seq,
+            "dim": self.dim,
+            "extractor": self.extractor,
+            "vectors": os.path.basename(self.vectors_path),
+            "devices": devices
+        }
+        _atomic_write(self.metadata_path, json.dumps(metadata, indent=2).encode())
+        # Entries up to `seq` are now in the snapshot, so a crash before this point is harmless
+        _atomic_write(self.journal_path, b"")
+        self.journal_entries = 0
+        self.journal_offset = 0
+        self._snapshot = _file_signature(self.metadata_path)
+
+    def compact(self, devices):
+        """Fold the journal into a snapshot, rewriting the vectors file if it is mostly garbage
+
+        A rewrite renumbers image["row"] in `devices` in place and bumps row_moves,
+        anything keyed by the old rows has to be rebuilt.
+        """
+        live_rows = sorted(image["row"] for device_data in devices.values()
+                           for image in device_data["images"])
+        old_vectors_path = None
+
+        if self.row_count > 2 * len(live_rows):
+            new_path = self._next_vectors_path()
+            _atomic_write(new_path, np.ascontiguousarray(self.get(live_rows)).tobytes())
+
+            remap = {row: new_row for new_row, row in enumerate(live_rows)}
+            for device_data in devices.values():
+                for image in device_data["images"]:
+                    image["row"] = remap[image["row"]]
+
+            old_vectors_path, self.vectors_path = self.vectors_path, new_path
+            self._vectors = None
+            self.row_moves += 1
+
+        # Only rows referenced by the snapshot are guaranteed to survive, cache just those
+        self.hash_rows = {}
+        self._remember_hashes(image for device_data in devices.values() for image in device_data["images"])
+        self.save(devices)
+
+        if old_vectors_path and os.path.exists(old_vectors_path):
+            os.remove(old_vectors_path)
+
+    def _next_vectors_path(self):
+        """Path of the next generation of the vectors file (<name>-<generation>.<ext>)"""
+        root, ext = os.path.splitext(self.vectors_path)
+        match = re.match(r'^(.*)-(\d+)$', root)
+        if match:
+            return f"{match.group(1)}-{int(match.group(2)) + 1}{ext}"
+        return f"{root}-1{ext}"
+
+    def start_generation(self, extractor, dim):
+        """Switch to an empty vectors file for vectors of a different extractor
+
+        The catalog must be re-populated with new rows and saved by the caller;
+        until then the previous snapshot keeps pointing at the old file.
+        """
+        old_vectors_path = self.vectors_path
+        self.vectors_path = self._next_vectors_path()
+        if os.path.exists(self.vectors_path):
+            os.remove(self.vectors_path)
+        self.extractor = extractor
+        self.dim = dim
+        self.hash_rows = {}
+        self._vectors = None
+        return old_vectors_path
+
+    def abandon_generation(self, devices, old_vectors_path, extractor, dim):
+        """Undo start_generation(): delete the new vectors file and go back to the old one
+
+        `devices` is the catalog that still references the old file.
+        """
+        if self.vectors_path != old_vectors_path and os.path.exists(self.vectors_path):
+            os.remove(self.vectors_path)
+        self.vectors_path = old_vectors_path
+        self.extractor = extractor
+        self.dim = dim
+        self.hash_rows = {}
+        self._remember_hashes(image for device_data in devices.values() for image in device_data["images"])
+        self._vectors = None
+
+    def vectors(self):
+        """Memory-mapped (rows, dim) view of every vector in the store"""
+        rows = self.row_count
+        if rows == 0:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        if self._vectors is None or len(self._vectors) != rows:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                                      shape=(rows, self.dim))
+        return self._vectors
+
+    def get(self, rows):
+        """Read the vectors stored at the given row numbers"""
+        return np.asarray(self.vectors()[np.asarray(rows, dtype=np.int64)])
+
+    def append(self, vectors):
+        """Append vectors to the end of the store and return their row numbers"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.size == 0:
+            # Nothing to store, also keeps an empty legacy list from fixing the dimension at 0
+            return []
+        if vectors.ndim == 1:
+            vectors = vectors[np.newaxis, :]
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dim features, got {vectors.shape[1]}")
+
+        start = self.row_count
+        with open(self.vectors_path, 'ab') as f:
+            # Drop any partial row left behind by an interrupted write
+            f.truncate(start * self.dim * 4)
+            f.write(np.ascontiguousarray(vectors).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        return list(range(start, start + len(vectors)))
+
+    def migrate_from_json(self, json_path, photos_dir):
+        """One-time import of a legacy devices.json with inline float lists
+
+        Vectors are paired with the device's photos in upload order when the
+        counts line up; otherwise the images are recorded without a filename.
+        """
+        with open(json_path, 'r') as f:
+            legacy = json.load(f)
+
+        devices = {}
+        for device_name, device_data in legacy.items():
+            rows = self.append(device_data.get("features", []))
+
+            device_dir = os.path.join(photos_dir, device_name)
+            filenames = []
+            if os.path.exists(device_dir):
+                filenames = sorted((f for f in os.listdir(device_dir)
+                                    if f.lower().endswith(('.jpg', '.jpeg', '.png', '.gif'))),
+                                   key=_natural_key)
+            if len(filenames) != len(rows):
+                filenames = [None] * len(rows)
+
+            devices[device_name] = {
+                "name": device_name,
+                "image_count": len(rows),
+                "images": [{"file": filename, "row": row} for filename, row in zip(filenames, rows)]
+            }
+
+        self.save(devices)
+        os.replace(json_path, json_path + ".migrated")
+        print(f"Migrated {len(devices)} devices from {json_path} to {self.vectors_path}")
+        return devices
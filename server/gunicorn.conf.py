@@ -0,0 +1,25 @@
+"""
+gunicorn settings for VisualAssistant, used as: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Module-level names are read as gunicorn settings, and "config" is one of them
+from config import HOST, PORT, WSGI_WORKERS, WSGI_THREADS
+
+bind = f"{HOST}:{PORT}"
+workers = WSGI_WORKERS
+threads = WSGI_THREADS
+worker_class = "gthread"
+# Load the app (and the feature index) once in the master, workers share its memory
+preload_app = True
+# Training uploads below BACKGROUND_UPLOAD_THRESHOLD images are processed inline
+timeout = 120
+
+
+def post_fork(arbiter, worker):
+    """Re-create the locks and thread pools a forked worker can't inherit"""
+    import server
+    server.after_fork()
@@ -0,0 +1,66 @@
+"""
+Reduced-resolution JPEG decoding
+libjpeg can decode straight to 1/2, 1/4 or 1/8 of the stored size by skipping
+most of the inverse DCT, which is cheaper and allocates a fraction of the
+memory of decoding the full frame and resizing it afterwards. The factor is
+picked from the dimensions in the JPEG header, so the result never ends up
+smaller than what the features are computed at.
+"""
+
+import cv2
+import numpy as np
+
+# Downscale factor -> imdecode flag, largest first
+REDUCED_FLAGS = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+# Start-of-frame markers carry the image size; C4 (DHT), C8 (JPG) and CC (DAC) share the range but don't
+_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def jpeg_size(data):
+    """(width, height) from a JPEG's start-of-frame header, None if data is not a readable JPEG"""
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            offset += 1     # Fill byte
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            offset += 2     # Markers without a length field
+            continue
+        length = (data[offset + 2] << 8) | data[offset + 3]
+        if marker in _SOF_MARKERS:
+            if offset + 9 > len(data):
+                return None
+            height = (data[offset + 5] << 8) | data[offset + 6]
+            width = (data[offset + 7] << 8) | data[offset + 8]
+            return (width, height) if width and height else None
+        if marker == 0xDA:
+            return None     # Reached the scan data without a frame header
+        offset += 2 + length
+    return None
+
+
+def reduction_flag(width, height, min_scale):
+    """imdecode flag for the strongest reduction that keeps at least `min_scale` of the size, and its factor"""
+    for factor, flag in REDUCED_FLAGS:
+        if 1.0 / factor >= min_scale:
+            return flag, factor
+    return cv2.IMREAD_COLOR, 1
+
+
+def decode_reduced(image_data, scale_for):
+    """Decode a JPEG at the smallest reduced size allowed by scale_for(width, height)
+
+    Returns:
+        ndarray: BGR image, or None if the data is not a JPEG or can't be decoded
+    """
+    size = jpeg_size(image_data)
+    if size is None:
+        return None
+    flag, _ = reduction_flag(size[0], size[1], scale_for(*size))
+    return cv2.imdecode(np.frombuffer(image_data, np.uint8), flag)
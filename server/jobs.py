@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobManager:
+    """Runs slow tasks (like large training uploads) in the background and tracks their state
+
+    With a state_dir every job's state is also written to <state_dir>/<id>.json,
+    so any server process can answer a status poll, not just the one running it.
+    """
+
+    def __init__(self, max_workers=1, keep_finished=100, state_dir=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.keep_finished = keep_finished
+        self.state_dir = state_dir
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+
+    def _state_path(self, job_id):
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _publish(self, job):
+        """Write a job's state for other processes"""
+        if not self.state_dir:
+            return
+        tmp_path = self._state_path(job["id"]) + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._state_path(job["id"]))
+
+    def submit(self, description, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) and return the job id"""
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "description": description,
+            "state": "queued",
+            "message": "",
+            "created": time.time(),
+            "finished": None
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+        self._publish(job)
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job, fn, args, kwargs):
+        """Execute a job and record its outcome"""
+        job["state"] = "running"
+        self._publish(job)
+        try:
+            if fn(*args, **kwargs) is False:
+                job["state"] = "failed"
+                job["message"] = f"{job['description']} failed"
+            else:
+                job["state"] = "done"
+                job["message"] = f"{job['description']} completed"
+        except Exception as e:
+            job["state"] = "failed"
+            job["message"] = f"{job['description']} failed: {e}"
+        job["finished"] = time.time()
+        self._publish(job)
+        self._prune()
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond keep_finished"""
+        with self._lock:
+            finished = sorted((job for job in self._jobs.values() if job["finished"] is not None),
+                              key=lambda job: job["finished"])
+            for job in finished[:-self.keep_finished]:
+                del self._jobs[job["id"]]
+                if self.state_dir and os.path.exists(self._state_path(job["id"])):
+                    os.remove(self._state_path(job["id"]))
+
+    def get(self, job_id):
+        """Return a copy of a job's state, or None if unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                return dict(job)
+        # Possibly running in another server process
+        if self.state_dir and job_id.isalnum():
+            try:
+                with open(self._state_path(job_id), 'r') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                return None
+        return None
@@ -0,0 +1,306 @@
+"""
+Lightweight request metrics - counters and latency histograms in Prometheus text format
+Only the standard library is used so the hot path pays a dict lookup and a lock per
+observation. Served by the /metrics endpoint in server.py.
+
+With several worker processes (gunicorn) each one writes its counters and histograms
+to <state_dir>/metrics-<pid>.json at most every flush_interval seconds, and /metrics
+adds up the files of every worker, so whichever worker answers a scrape reports the
+same monotonic totals. Files of exited workers are kept so their counts don't vanish,
+the directory is cleared when the server (the pre-loading master process) starts.
+"""
+
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds, tuned for per-stage timings of a few milliseconds up to a slow automation backend
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+CONFIDENCE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0)
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Counter:
+    """Monotonic counter, one value per label combination"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def reset(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """[[labels, value], ...] for a state file"""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(total, snapshot):
+        """Add a state file's snapshot into {labels: value}"""
+        for key, value in snapshot:
+            key = tuple(tuple(pair) for pair in key)
+            total[key] = total.get(key, 0) + value
+
+    def render(self, values=None):
+        """Exposition lines of this process's values, or of merged `values`"""
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_label_text(key)} {value}")
+        return lines
+
+
+class CounterFunction(Counter):
+    """Counter whose values are read from fn() when collected, for totals kept elsewhere (e.g. cache stats)
+
+    fn returns a number, or {label value: number} when `label` is given.
+    """
+
+    def __init__(self, name, help_text, fn, label=None):
+        super().__init__(name, help_text)
+        self.fn = fn
+        self.label = label
+
+    def _collect(self):
+        value = self.fn()
+        if self.label is None:
+            return {(): value}
+        return {((self.label, label_value),): count for label_value, count in value.items()}
+
+    def reset(self):
+        pass
+
+    def snapshot(self):
+        return [[list(key), value] for key, value in self._collect().items()]
+
+    def render(self, values=None):
+        return super().render(self._collect() if values is None else values)
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one set of buckets per label combination"""
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._values = {}   # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            values[index] += 1
+            values[-1] += value
+
+    def reset(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """[[labels, bucket counts and sum], ...] for a state file"""
+        with self._lock:
+            return [[list(key), list(values)] for key, values in self._values.items()]
+
+    @staticmethod
+    def merge(total, snapshot):
+        """Add a state file's snapshot into {labels: bucket counts and sum}"""
+        for key, values in snapshot:
+            key = tuple(tuple(pair) for pair in key)
+            merged = total.get(key)
+            total[key] = values if merged is None else [a + b for a, b in zip(merged, values)]
+
+    def render(self, values=None):
+        """Exposition lines of this process's values, or of merged `values`"""
+        if values is None:
+            with self._lock:
+                values = {key: list(counts) for key, counts in self._values.items()}
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_text(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(key)} {counts[-1]}")
+            lines.append(f"{self.name}_count{_label_text(key)} {cumulative}")
+        return lines
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metrics:
+    """All metrics the server collects, added up across worker processes when given a state_dir"""
+
+    def __init__(self, state_dir=None, flush_interval=1.0):
+        self.stage_seconds = Histogram("visualassistant_stage_seconds",
+                                       "Time spent in each stage of a request")
+        self.requests = Counter("visualassistant_requests_total",
+                                "API requests by endpoint and HTTP status")
+        self.recognitions = Counter("visualassistant_recognitions_total",
+                                    "Recognition results, hit when a device passed SIMILARITY_THRESHOLD")
+        self.confidence = Histogram("visualassistant_recognition_confidence",
+                                    "Best similarity score of each recognition", CONFIDENCE_BUCKETS)
+        self.automation_errors = Counter("visualassistant_automation_errors_total",
+                                         "Failed or raising execute_command calls by automation module")
+        self._collectors = [self.stage_seconds, self.requests, self.recognitions,
+                            self.confidence, self.automation_errors]
+        self._gauges = {}   # name -> (help text, callable returning the value, per worker)
+        self.state_dir = state_dir
+        self.flush_interval = flush_interval
+        self._flushed = 0
+        self._flush_lock = threading.Lock()
+        self._written = None        # contents of the last state file write
+        self._flusher_pid = None    # process the background flush thread runs in
+        if state_dir:
+            # Counts of a previous run would add to this one's
+            os.makedirs(state_dir, exist_ok=True)
+            for path in glob.glob(os.path.join(state_dir, "metrics-*.json")):
+                os.remove(path)
+
+    def after_fork(self):
+        """Start a forked worker process from zero, its counts go to its own state file"""
+        for collector in self._collectors:
+            collector.reset()
+        self._flushed = 0
+        self._flush_lock = threading.Lock()
+        self._written = None
+
+    def counter_function(self, name, help_text, fn, label=None):
+        """Register a total that is kept elsewhere and read from fn() when collected"""
+        self._collectors.append(CounterFunction(name, help_text, fn, label))
+
+    def gauge(self, name, help_text, fn, per_worker=False):
+        """Register a value that is read when /metrics is scraped
+
+        per_worker gauges describe one process (e.g. its caches) and are reported
+        for every live worker with a "worker" label, the others (e.g. catalog
+        size, the same in every worker) by the process answering the scrape.
+        """
+        self._gauges[name] = (help_text, fn, per_worker)
+
+    def _state_path(self, pid):
+        return os.path.join(self.state_dir, f"metrics-{pid}.json")
+
+    def flush(self, force=False):
+        """Write this process's values to its state file, at most every flush_interval seconds
+
+        Values observed in between are written by a background thread, so a
+        worker's file is never more than flush_interval behind, even when idle.
+        """
+        if not self.state_dir:
+            return
+        if self._flusher_pid != os.getpid():
+            # Threads don't survive a fork, every worker starts its own
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_periodically, daemon=True).start()
+        if not force and time.time() - self._flushed < self.flush_interval:
+            return
+        with self._flush_lock:
+            self._flushed = time.time()
+            state = json.dumps({
+                "collectors": {collector.name: collector.snapshot() for collector in self._collectors},
+                "gauges": {name: fn() for name, (_, fn, per_worker) in self._gauges.items() if per_worker}
+            })
+            if state == self._written:
+                return
+            path = self._state_path(os.getpid())
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(state)
+            os.replace(tmp_path, path)
+            self._written = state
+
+    def _flush_periodically(self):
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            time.sleep(self.flush_interval)
+            self.flush(force=True)
+
+    def _worker_states(self):
+        """{pid: state} of every worker that wrote a state file"""
+        states = {}
+        for path in glob.glob(os.path.join(self.state_dir, "metrics-*.json")):
+            try:
+                with open(path, 'r') as f:
+                    states[int(os.path.basename(path)[len("metrics-"):-len(".json")])] = json.load(f)
+            except (OSError, ValueError):
+                continue    # Removed or replaced while listing
+        return states
+
+    @contextmanager
+    def timer(self, stage, breakdown=None):
+        """Time a block as `stage`, also recording milliseconds into `breakdown` if given"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stage_seconds.observe(elapsed, stage=stage)
+            if breakdown is not None:
+                breakdown[stage] = round(breakdown.get(stage, 0) + elapsed * 1000, 3)
+
+    def record_recognition(self, recognized_device, confidence):
+        self.recognitions.inc(result="hit" if recognized_device is not None else "miss")
+        self.confidence.observe(float(confidence))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        if not self.state_dir:
+            lines = []
+            for collector in self._collectors:
+                lines.extend(collector.render())
+            for name, (help_text, fn, _) in self._gauges.items():
+                lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {fn()}"])
+            return "\n".join(lines) + "\n"
+
+        # Only the files are added up, never this process's live values, so that every worker
+        # answers with totals that are at least those of any earlier scrape
+        self.flush(force=True)
+        states = self._worker_states()
+        lines = []
+        for collector in self._collectors:
+            total = {}
+            for state in states.values():
+                collector.merge(total, state["collectors"].get(collector.name, []))
+            lines.extend(collector.render(total))
+        for name, (help_text, fn, per_worker) in self._gauges.items():
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge"])
+            if not per_worker:
+                lines.append(f"{name} {fn()}")
+                continue
+            for pid, state in sorted(states.items()):
+                if name in state["gauges"] and _process_alive(pid):
+                    lines.append(f"{name}{_label_text((('worker', pid),))} {state['gauges'][name]}")
+        return "\n".join(lines) + "\n"
@@ -1,59 +1,214 @@
 """
 Home Assistant Module - Integration with Home Assistant
 Uncomment and configure this module to use with Home Assistant
+
+Entity states are cached from /api/states, so commands that would not change
+anything (turning on a light that is already on) never reach the hub, and
+recognized device names are matched to entity_ids by friendly name. A command
+is only skipped on a freshly read state, the entity may have been switched
+from a wall switch or the Home Assistant app since the last refresh.
 """
 
-import requests
+import re
+import threading
+import time
+from .http_session import create_session
 
 HOME_ASSISTANT_URL = "http://192.168.1.50:8123"
 HOME_ASSISTANT_TOKEN = "your_long_lived_access_token_here"
 
-def execute_command(device_name, action):
+# (connect, read) timeout in seconds, so a slow hub can't block the server indefinitely
+REQUEST_TIMEOUT = (3, 5)
+REQUEST_RETRIES = 2
+
+# Re-read every entity state from /api/states after this many seconds
+STATE_CACHE_TTL = 30
+
+# Skip a command as a no-op only if the entity's state was read this many seconds ago at most,
+# an older state is re-read from /api/states/<entity_id> first
+SKIP_STATE_MAX_AGE = 2
+
+# Device names (as trained in the web UI) that don't match an entity's friendly name
+# Example: {"tv": "media_player.living_room", "desk lamp": "light.office_1"}
+ENTITY_ALIASES = {}
+
+# One keep-alive connection pool for every command
+session = create_session(retries=REQUEST_RETRIES, headers={
+    "Authorization": f"Bearer {HOME_ASSISTANT_TOKEN}",
+    "Content-Type": "application/json"
+})
+
+_states = {}        # entity_id -> "on" / "off" / ...
+_state_times = {}   # entity_id -> time its state was read, or set by a confirmed service call
+_entity_index = {}  # normalized friendly name or object id -> entity_id
+_states_fetched = 0
+_lock = threading.Lock()
+
+def _normalize(name):
+    """Lowercase name with spaces, dashes and underscores folded together"""
+    return re.sub(r'[\s_\-]+', ' ', name).strip().lower()
+
+def refresh_states(force=False):
     """
-    Execute a command via Home Assistant API
+    Bulk-refresh the cached entity states and the name -> entity_id index
     
     Args:
-        device_name (str): Name of the device (entity_id in HA)
-        action (str): Action to perform ("on" or "off")
-
+        force (bool): Refresh even if the cache is younger than STATE_CACHE_TTL
+    
     Returns:
-        dict: Result of the command execution
-    """ 
-    # Uncomment and configure for actual Home Assistant integration
+        bool: Whether the cache holds states (possibly stale if the refresh failed)
+    """
+    global _states_fetched
+    
+    if not force and time.time() - _states_fetched < STATE_CACHE_TTL:
+        return True
+    
     try:
-        headers = {
-            "Authorization": f"Bearer {HOME_ASSISTANT_TOKEN}",
-            "Content-Type": "application/json"
-        }
+        response = session.get(f"{HOME_ASSISTANT_URL}/api/states", timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        entities = response.json()
+    except Exception as e:
+        print(f"Could not refresh Home Assistant states: {e}")
+        # Don't retry on every command while the hub is down
+        _states_fetched = time.time()
+        return bool(_states)
+    
+    states = {}
+    index = {}
+    for entity in entities:
+        entity_id = entity["entity_id"]
+        states[entity_id] = entity.get("state")
+        index[_normalize(entity_id.split(".", 1)[-1])] = entity_id
+        friendly_name = entity.get("attributes", {}).get("friendly_name")
+        if friendly_name:
+            index[_normalize(friendly_name)] = entity_id
+    
+    with _lock:
+        _states.clear()
+        _states.update(states)
+        _entity_index.clear()
+        _entity_index.update(index)
+        _states_fetched = time.time()
+        _state_times.clear()
+        _state_times.update(dict.fromkeys(states, _states_fetched))
+    return True
+
+def refresh_entity(entity_id):
+    """Re-read the state of one entity, None if it could not be read"""
+    try:
+        response = session.get(f"{HOME_ASSISTANT_URL}/api/states/{entity_id}", timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        state = response.json().get("state")
+    except Exception as e:
+        print(f"Could not read the state of {entity_id}: {e}")
+        return None
+    
+    with _lock:
+        _states[entity_id] = state
+        _state_times[entity_id] = time.time()
+    return state
+
+def resolve_entity(device_name):
+    """Map a recognized device name to a Home Assistant entity_id"""
+    if device_name in ENTITY_ALIASES:
+        return ENTITY_ALIASES[device_name]
+    if "." in device_name:
+        return device_name  # Already an entity_id
+    
+    refresh_states()
+    with _lock:
+        return _entity_index.get(_normalize(device_name), device_name)
+
+def _result(device_name, action, success, message, **extra):
+    result = {
+        "success": success,
+        "message": message,
+        "device": device_name,
+        "action": action
+    }
+    result.update(extra)
+    return result
+
+def execute_commands(commands):
+    """
+    Execute several commands with at most one service call per action
+    
+    Args:
+        commands (list): (device_name, action) tuples
+    
+    Returns:
+        list: Result dict per command, in the same order
+    """
+    results = [None] * len(commands)
+    targets = {}    # service -> {entity_id: [command indexes]}
+    
+    refresh_states()
+    entity_ids = [resolve_entity(device_name) for device_name, _ in commands]
+    # Only the last command for an entity matters, earlier ones are superseded
+    last_command = {entity_id: i for i, entity_id in enumerate(entity_ids)}
+    
+    for i, (device_name, action) in enumerate(commands):
+        entity_id = entity_ids[i]
+        if last_command[entity_id] != i:
+            results[i] = _result(device_name, action, True, f"Superseded by a later command for {device_name}",
+                                 entity_id=entity_id, skipped=True)
+            continue
+        
+        with _lock:
+            current_state = _states.get(entity_id)
+            state_age = time.time() - _state_times.get(entity_id, 0)
+        
+        # Only trust a recent state for a skip, an unreadable state sends the command anyway
+        if current_state == action and state_age > SKIP_STATE_MAX_AGE:
+            current_state = refresh_entity(entity_id)
+        
+        # Skip commands that would not change anything
+        if current_state == action:
+            results[i] = _result(device_name, action, True, f"{device_name} is already {action}",
+                                 entity_id=entity_id, skipped=True)
+            continue
         
         # Map action to Home Assistant service
         service = "turn_on" if action == "on" else "turn_off"
+        targets.setdefault(service, {}).setdefault(entity_id, []).append(i)
+    
+    for service, entities in targets.items():
+        try:
+            url = f"{HOME_ASSISTANT_URL}/api/services/homeassistant/{service}"
+            response = session.post(url, json={"entity_id": list(entities)}, timeout=REQUEST_TIMEOUT)
+            success = response.status_code == 200
+            error = response.text
+        except Exception as e:
+            success = False
+            error = str(e)
         
-        url = f"{HOME_ASSISTANT_URL}/api/services/homeassistant/{service}"
-        data = {"entity_id": device_name}
-        
-        response = requests.post(url, json=data, headers=headers)
+        if success:
+            # Home Assistant confirmed the call, assume the new state until the next refresh
+            with _lock:
+                for entity_id in entities:
+                    _states[entity_id] = "on" if service == "turn_on" else "off"
+                    _state_times[entity_id] = time.time()
         
-        if response.status_code == 200:
-            return {
-                "success": True,
-                "message": f"Successfully turned {device_name} {action}",
-                "device": device_name,
-                "action": action
-            }
-        else:
-            return {
-                "success": False,
-                "message": f"Failed to control {device_name}: {response.text}",
-                "device": device_name,
-                "action": action
-            }
-            
-    except Exception as e:
-        return {
-            "success": False,
-            "message": f"Error controlling {device_name}: {str(e)}",
-            "device": device_name,
-            "action": action
-        }
-    
\ No newline at end of file
+        for entity_id, indexes in entities.items():
+            for i in indexes:
+                device_name, action = commands[i]
+                if success:
+                    results[i] = _result(device_name, action, True, f"Successfully turned {device_name} {action}",
+                                         entity_id=entity_id)
+                else:
+                    results[i] = _result(device_name, action, False, f"Failed to control {device_name}: {error}",
+                                         entity_id=entity_id)
+    return results
+
+def execute_command(device_name, action):
+    """
+    Execute a command via Home Assistant API
+    
+    Args:
+        device_name (str): Name of the device (friendly name or entity_id in HA)
+        action (str): Action to perform ("on" or "off")
+    
+    Returns:
+        dict: Result of the command execution
+    """
+    return execute_commands([(device_name, action)])[0]
@@ -5,6 +5,7 @@ This module can be used for custom smart home setups that accept HTTP commands
 
 import requests
 import json
+from .http_session import create_session
 
 # Configuration - edit these for your setup
 DEVICE_ENDPOINTS = {
@@ -21,6 +22,10 @@ DEVICE_ENDPOINTS = {
 
 # Default timeout for HTTP requests
 REQUEST_TIMEOUT = 5
+REQUEST_RETRIES = 2
+
+# Keep-alive connections are reused between commands
+session = create_session(retries=REQUEST_RETRIES)
 
 def execute_command(device_name, action):
     """
@@ -58,7 +63,7 @@ def execute_command(device_name, action):
     
     try:
         # Make HTTP request
-        response = requests.get(url, timeout=REQUEST_TIMEOUT)
+        response = session.get(url, timeout=REQUEST_TIMEOUT)
         
         if response.status_code == 200:
             return {
@@ -0,0 +1,38 @@
+"""
+Shared HTTP plumbing for automation modules - pooled keep-alive sessions with retries
+Not an automation module itself, import it from one.
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def create_session(retries=2, backoff=0.2, pool_size=4, headers=None):
+    """
+    requests.Session that reuses TCP connections and retries failed requests
+    
+    Args:
+        retries (int): Retries on connection errors, read errors and 502/503/504 responses
+        backoff (float): Base of the exponential delay between retries in seconds
+        pool_size (int): Keep-alive connections kept per host
+        headers (dict): Headers sent with every request
+    
+    Returns:
+        requests.Session: Session to use for all requests of a module
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=None,  # on/off service calls are idempotent, retry POST too
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
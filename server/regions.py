@@ -0,0 +1,75 @@
+"""
+Region features - histograms of many windows of a frame from a single pass over its pixels
+The frame is split into a grid of cells and every window is a block of whole
+cells. Per-cell histograms take one bincount per channel; their 2D prefix sum
+(an integral histogram over the cells) then gives any window's histogram from
+four lookups, so scoring dozens of windows at several scales costs about as
+much as extracting one global feature vector.
+"""
+
+import math
+import cv2
+import numpy as np
+
+
+def grid_windows(grid, sizes):
+    """(row, col, rows, cols) in cells of every square window of the given sizes, moved one cell at a time"""
+    windows = []
+    for size in sizes:
+        size = min(size, grid)
+        for row in range(grid - size + 1):
+            for col in range(grid - size + 1):
+                windows.append((row, col, size, size))
+    return np.array(sorted(set(windows)), dtype=np.int64).reshape(-1, 4)
+
+
+def window_features(extractor, image, grid, windows):
+    """Feature vectors, shape (windows, extractor.dim), of windows of an image
+
+    Close to extractor.extract() on each cropped window; histograms are counted
+    at the image's resolution instead of after resizing the crop.
+    """
+    height, width = image.shape[:2]
+    cells = (np.arange(height) * grid // height)[:, np.newaxis] * grid + (np.arange(width) * grid // width)[np.newaxis, :]
+    top, left = windows[:, 0], windows[:, 1]
+    bottom, right = top + windows[:, 2], left + windows[:, 3]
+
+    parts = []
+    for bin_map, bins in extractor.bin_maps(image):
+        counts = np.bincount((cells * bins + bin_map).ravel(), minlength=grid * grid * bins)
+        integral = np.zeros((grid + 1, grid + 1, bins), dtype=np.float32)
+        integral[1:, 1:] = counts.reshape(grid, grid, bins).cumsum(axis=0).cumsum(axis=1)
+        hist = integral[bottom, right] - integral[top, right] - integral[bottom, left] + integral[top, left]
+
+        # Each histogram is L2-normalized on its own, like cv2.normalize in the extractors
+        norms = np.linalg.norm(hist, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        parts.append(hist / norms)
+    return np.hstack(parts).astype(np.float32)
+
+
+def center_weights(windows, grid, center_weight):
+    """1 for a window centered in the frame, down to 1 - center_weight for one centered on a corner"""
+    rows = (windows[:, 0] + windows[:, 2] / 2) / grid - 0.5
+    cols = (windows[:, 1] + windows[:, 3] / 2) / grid - 0.5
+    distance = np.sqrt(rows ** 2 + cols ** 2) / math.sqrt(0.5)
+    return 1.0 - center_weight * distance
+
+
+def resize_longest(image, size):
+    """Scale an image down so its longest side is at most `size` pixels, returns (image, scale)"""
+    height, width = image.shape[:2]
+    scale = min(1.0, size / max(height, width))
+    if scale < 1.0:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    return image, scale
+
+
+def window_boxes(windows, grid, width, height):
+    """[x, y, width, height] pixel boxes of cell windows in a frame of the given size"""
+    x0 = windows[:, 1] * width // grid
+    y0 = windows[:, 0] * height // grid
+    x1 = (windows[:, 1] + windows[:, 3]) * width // grid
+    y1 = (windows[:, 0] + windows[:, 2]) * height // grid
+    return np.stack([x0, y0, x1 - x0, y1 - y0], axis=1)
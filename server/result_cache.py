@@ -0,0 +1,99 @@
+import collections
+import threading
+import time
+import cv2
+import numpy as np
+
+
+def frame_hash(image):
+    """64-bit difference hash of a BGR image: brightness gradients of a 9x8 thumbnail
+
+    Stays the same (or within a few bits) across JPEG noise, small shifts and
+    exposure changes, unlike a hash of the uploaded bytes.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class RecognitionCache:
+    """Recent recognition results keyed by frame hash, for cameras that keep sending the same view
+
+    A result is reused for a frame whose hash differs in at most max_distance
+    bits. Entries expire after ttl seconds and the least recently used is
+    evicted beyond max_entries. invalidate() drops everything, it is called
+    whenever the device catalog changes; results computed against the old
+    catalog are refused by put() through the generation returned by get().
+    """
+
+    def __init__(self, max_entries=256, ttl=10, max_distance=2):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.generation = 0
+        self._entries = collections.OrderedDict()   # hash -> (stored at, result), least recently used first
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "near_hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def after_fork(self):
+        """Re-create the lock in a forked server process"""
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Result remembered for this or a near-identical frame
+
+        Returns:
+            tuple: (generation to pass to put(), (device name, confidence) or None)
+        """
+        if self.max_entries <= 0:
+            return self.generation, None
+        now = time.time()
+        with self._lock:
+            match = key if key in self._entries else None
+            if match is None and self.max_distance > 0:
+                # Nearest stored hash by Hamming distance, a linear scan of a few hundred ints
+                nearest = min(self._entries, key=lambda stored: (stored ^ key).bit_count(), default=None)
+                if nearest is not None and (nearest ^ key).bit_count() <= self.max_distance:
+                    match = nearest
+
+            if match is not None and now - self._entries[match][0] > self.ttl:
+                del self._entries[match]
+                self.stats["expired"] += 1
+                match = None
+
+            if match is None:
+                self.stats["misses"] += 1
+                return self.generation, None
+
+            self._entries.move_to_end(match)
+            self.stats["hits" if match == key else "near_hits"] += 1
+            return self.generation, self._entries[match][1]
+
+    def put(self, key, result, generation):
+        """Remember a result, unless the catalog changed since the matching get()"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (time.time(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self):
+        """Forget every result, the catalog they were computed against changed"""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.stats["invalidations"] += 1
+
+    def summary(self):
+        """Counters, current size and hit rate"""
+        with self._lock:
+            summary = dict(self.stats, size=len(self._entries))
+        lookups = summary["hits"] + summary["near_hits"] + summary["misses"]
+        summary["hit_rate"] = (summary["hits"] + summary["near_hits"]) / lookups if lookups else 0.0
+        return summary
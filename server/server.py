@@ -1,19 +1,48 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, send_from_directory
-import cv2
-import numpy as np
-from PIL import Image
+from flask import Flask, Request, request, jsonify, render_template, redirect, url_for, flash, send_file, send_from_directory, g
 import io
 import importlib
 import os
+import time
 import config
+from client_state import ClientStates
 from device_recognition import DeviceRecognizer
+from dispatcher import AutomationDispatcher
+from jobs import JobManager
+from metrics import Metrics
+from sessions import SessionManager
+
+class UploadRequest(Request):
+    """Keeps uploaded files of small requests in memory, so upload_bytes() can hand them over without a copy"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= config.IN_MEMORY_UPLOAD_LIMIT:
+            return io.BytesIO()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.secret_key = "ironman_helmet_secret_key_change_this"
 
 # Initialize device recognizer
 recognizer = DeviceRecognizer()
 
+# Background jobs for large training uploads
+jobs = JobManager(state_dir=config.JOBS_STATE_DIR)
+
+def start_reindex():
+    """Recompute stored vectors in the background after FEATURE_EXTRACTOR was changed"""
+    if recognizer.needs_reindex():
+        jobs.submit("Re-indexing training images", recognizer.reindex)
+
+def after_fork():
+    """Called in each worker process forked from a server that pre-loaded this module (see wsgi.py)"""
+    global jobs
+    recognizer.after_fork()
+    dispatcher.after_fork()
+    clients.after_fork()
+    metrics.after_fork()
+    jobs = JobManager(state_dir=config.JOBS_STATE_DIR)
+
 def load_automation_module():
     """Load the configured home automation module"""
     try:
@@ -26,11 +55,138 @@ def load_automation_module():
 
 automation_module = load_automation_module()
 
+# Per-stage timers and counters, scraped from /metrics and added up across worker processes
+metrics = Metrics(state_dir=config.METRICS_DIR, flush_interval=config.METRICS_FLUSH_INTERVAL)
+metrics.gauge("visualassistant_devices", "Registered devices", lambda: len(recognizer.devices))
+metrics.gauge("visualassistant_training_vectors", "Training vectors in the feature index", lambda: len(recognizer.index))
+metrics.gauge("visualassistant_index_bytes", "Memory held by the feature index", lambda: recognizer.index.nbytes)
+metrics.counter_function("visualassistant_result_cache_lookups_total",
+                         "Recognition result cache lookups by result (hit, near_hit, miss)",
+                         lambda: {result: recognizer.result_cache.summary()[key]
+                                  for result, key in (("hit", "hits"), ("near_hit", "near_hits"), ("miss", "misses"))},
+                         label="result")
+metrics.gauge("visualassistant_result_cache_entries", "Frames held by the recognition result cache of each worker",
+              lambda: recognizer.result_cache.summary()["size"], per_worker=True)
+metrics.counter_function("visualassistant_reused_recognitions_total",
+                         "Commands answered with the client's previous recognition",
+                         lambda: clients.summary()["reused"])
+metrics.counter_function("visualassistant_debounced_commands_total",
+                         "Repeated commands that were not executed again",
+                         lambda: clients.summary()["debounced"])
+
+# Sends commands to the automation module, in the background unless the client asks to wait
+dispatcher = AutomationDispatcher(automation_module, config.DEFAULT_MODULE, metrics)
+
+# Streaming sessions: frames are recognized while the client is still transcribing the command
+sessions = SessionManager(ttl=config.SESSION_TTL, max_frames=config.MAX_SESSION_FRAMES)
+
+# Recent recognitions and commands per client: score smoothing, recognition reuse and debouncing
+clients = ClientStates(window=config.SMOOTHING_WINDOW, reuse_ttl=config.REUSE_TTL,
+                       reuse_similarity=config.REUSE_MIN_SIMILARITY, debounce=config.DEBOUNCE_INTERVAL,
+                       max_clients=config.MAX_TRACKED_CLIENTS)
+
+def timing_breakdown():
+    """Dict collecting per-stage milliseconds if the client sent the debug timing header, else None"""
+    if request.headers.get(config.DEBUG_TIMING_HEADER):
+        return {}
+    return None
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.before_request
+def refresh_devices():
+    """Pick up device edits made through another worker process"""
+    recognizer.refresh()
+
+@app.after_request
+def count_request(response):
+    if request.path.startswith('/api/'):
+        metrics.requests.inc(endpoint=request.endpoint or "unknown", status=response.status_code)
+        metrics.stage_seconds.observe(time.perf_counter() - g.request_start, stage="request")
+    metrics.flush()
+    return response
+
+def upload_bytes(file_storage):
+    """Contents of an uploaded file, in-memory uploads share the parser's buffer instead of being copied"""
+    if isinstance(file_storage.stream, io.BytesIO):
+        return file_storage.stream.getvalue()
+    return file_storage.read()
+
+def client_id():
+    """Who sent the request: its X-Client-Id header, else its address"""
+    return request.headers.get(config.CLIENT_ID_HEADER) or request.remote_addr
+
+def wants_sync():
+    """Whether the client asked to wait for the automation result ('sync' form field)"""
+    return request.form.get('sync', '').lower() in ['true', '1', 'yes']
+
+def run_command(recognized_device, confidence, device_query, action, breakdown=None, sync=False):
+    """Validate the recognition against the requested device and execute the action
+    
+    With AUTOMATION_ASYNC the command is queued and a "queued" result is returned
+    right away, unless `sync` is set. A command the same client had executed (or
+    queued) within DEBOUNCE_INTERVAL is not executed again and answered with 429,
+    a failed one can be retried right away. Stage timings are added to `breakdown`
+    when one is given.
+    
+    Returns:
+        tuple: (response dict, HTTP status code)
+    """
+    if recognized_device is None:
+        return {
+            "success": False,
+            "message": f"Could not recognize any device in image. Confidence: {confidence:.2f}"
+        }, 404
+    
+    # For visual_target, we use whatever device is recognized
+    # For specific device names, we validate the recognition matches
+    if device_query == "visual_target":
+        target_device = recognized_device
+    else:
+        # Check if recognized device matches the requested device (fuzzy matching)
+        if device_query.lower() not in recognized_device.lower() and recognized_device.lower() not in device_query.lower():
+            return {
+                "success": False,
+                "message": f"Recognized '{recognized_device}' but requested '{device_query}'. Confidence: {confidence:.2f}"
+            }, 400
+        target_device = recognized_device
+    
+    client = client_id()
+    if not clients.claim(client, target_device, action):
+        return {
+            "success": False,
+            "debounced": True,
+            "message": f"Ignored '{action}' for '{target_device}', the same command was sent less than "
+                       f"{config.DEBOUNCE_INTERVAL}s ago",
+            "recognized_device": recognized_device,
+            "target_device": target_device,
+            "confidence": confidence,
+            "requested_device": device_query
+        }, 429
+    
+    # Execute command via automation module
+    if config.AUTOMATION_ASYNC and not sync:
+        result = dispatcher.submit(target_device, action)
+    else:
+        result = dispatcher.execute(target_device, action, breakdown)
+    if not result.get("success", False):
+        clients.release(client, target_device, action)
+    
+    # Add recognition info to result
+    result["recognized_device"] = recognized_device
+    result["target_device"] = target_device
+    result["confidence"] = confidence
+    result["requested_device"] = device_query
+    
+    return result, 200
+
 @app.route('/')
 def index():
     """Main web interface"""
     devices = recognizer.get_devices_list()
-    return render_template('index.html', devices=devices)
+    return render_template('index.html', devices=devices, job_id=request.args.get('job'))
 
 @app.route('/add_device', methods=['GET', 'POST'])
 def add_device():
@@ -47,25 +203,23 @@ def add_device():
             flash('At least one image is required', 'error')
             return redirect(url_for('add_device'))
         
-        # Convert to PIL Images
-        pil_images = []
-        for img_file in images:
-            if img_file.filename != '':
-                try:
-                    pil_img = Image.open(img_file.stream)
-                    pil_images.append(pil_img)
-                except Exception as e:
-                    flash(f'Error processing image {img_file.filename}: {e}', 'error')
-                    return redirect(url_for('add_device'))
-        
-        if len(pil_images) == 0:
+        # Read raw upload bytes, decoding happens in the recognizer's worker pool
+        uploads = [img_file.read() for img_file in images if img_file.filename != '']
+        
+        if len(uploads) == 0:
             flash('No valid images uploaded', 'error')
             return redirect(url_for('add_device'))
         
+        # Large uploads are processed in the background so the web UI stays responsive
+        if len(uploads) > config.BACKGROUND_UPLOAD_THRESHOLD:
+            job_id = jobs.submit(f'Adding device "{device_name}"', recognizer.add_device, device_name, uploads)
+            flash(f'Processing {len(uploads)} images for "{device_name}" in the background', 'success')
+            return redirect(url_for('index', job=job_id))
+        
         # Add device
         try:
-            recognizer.add_device(device_name, pil_images)
-            flash(f'Device "{device_name}" added successfully with {len(pil_images)} images', 'success')
+            recognizer.add_device(device_name, uploads)
+            flash(f'Device "{device_name}" added successfully with {len(uploads)} images', 'success')
             return redirect(url_for('index'))
         except Exception as e:
             flash(f'Error adding device: {e}', 'error')
@@ -86,11 +240,14 @@ def delete_device(device_name):
 @app.route('/api/process_command', methods=['POST'])
 def process_command():
     """API endpoint to process commands from client"""
+    breakdown = timing_breakdown()
     try:
-        # Get image and command data
-        image_file = request.files.get('image')
-        device_query = request.form.get('device', '').strip()
-        action = request.form.get('action', '').strip()
+        # Get image and command data (accessing request.files parses the multipart body)
+        with metrics.timer("parse", breakdown):
+            image_file = request.files.get('image')
+            device_query = request.form.get('device', '').strip()
+            action = request.form.get('action', '').strip()
+            image_data = upload_bytes(image_file) if image_file else None
         
         if not image_file or not device_query or not action:
             return jsonify({
@@ -99,9 +256,8 @@ def process_command():
             }), 400
         
         # Process image
-        image_data = image_file.read()
-        nparr = np.frombuffer(image_data, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        with metrics.timer("decode", breakdown):
+            image = recognizer.decode_query(image_data)
         
         if image is None:
             return jsonify({
@@ -109,38 +265,172 @@ def process_command():
                 "message": "Invalid image data"
             }), 400
         
-        # Recognize device
-        recognized_device, confidence = recognizer.recognize_device(image)
+        # Recognize device, a still camera keeps sending the same view so try recent results first
+        client = client_id()
+        frame_key, generation, cached = recognizer.cached_result(image)
+        reused = None
+        smoothed_frames = 1
+        if cached is not None:
+            recognized_device, confidence = cached
+        elif config.RECOGNITION_MODE == "regions":
+            with metrics.timer("detect", breakdown):
+                recognized_device, confidence = recognizer.recognize_regions(image)
+            recognizer.remember_result(frame_key, generation, (recognized_device, confidence))
+        else:
+            with metrics.timer("extract", breakdown):
+                features = recognizer.extract_features(image)
+            # The client's last recognition still holds while its view barely moved
+            reused = clients.reuse(client, features, generation)
+            if reused is not None:
+                recognized_device, confidence = reused
+            else:
+                with metrics.timer("recognize", breakdown):
+                    scores = recognizer.score_devices(features)
+                recognizer.remember_result(frame_key, generation, recognizer.best_match(scores))
+                # Averaged with the client's previous frames, so one blurry frame doesn't decide
+                scores, smoothed_frames = clients.smooth(client, scores, generation)
+                recognized_device, confidence = recognizer.best_match(scores)
+                clients.remember(client, features, recognized_device, confidence, generation)
+        metrics.record_recognition(recognized_device, confidence)
+        
+        result, status = run_command(recognized_device, confidence, device_query, action, breakdown, wants_sync())
+        result["cached_recognition"] = cached is not None
+        result["reused_recognition"] = reused is not None
+        result["smoothed_frames"] = smoothed_frames
+        if breakdown is not None:
+            result["timing_ms"] = breakdown
+        return jsonify(result), status
+        
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+@app.route('/api/recognize_batch', methods=['POST'])
+def recognize_batch():
+    """API endpoint to recognize a burst of frames and vote on the device
+    
+    Accepts several 'images' files in one multipart request. If 'action' is
+    given, the command is executed on the voted device like /api/process_command.
+    """
+    breakdown = timing_breakdown()
+    try:
+        with metrics.timer("parse", breakdown):
+            image_files = [f for f in request.files.getlist('images') if f.filename != '']
+            device_query = request.form.get('device', 'visual_target').strip()
+            action = request.form.get('action', '').strip()
+            image_datas = [upload_bytes(f) for f in image_files]
+        
+        if not image_files:
+            return jsonify({
+                "success": False,
+                "message": "No images uploaded"
+            }), 400
+        
+        if len(image_files) > config.MAX_BATCH_FRAMES:
+            return jsonify({
+                "success": False,
+                "message": f"Too many frames, at most {config.MAX_BATCH_FRAMES} are accepted"
+            }), 400
+        
+        # Decode and extract features in parallel, then score all frames not cached in one pass
+        frame_results = recognizer.recognize_uploads(image_datas, lambda stage: metrics.timer(stage, breakdown))
+        valid = [i for i, result in enumerate(frame_results) if result is not None]
         
-        if recognized_device is None:
+        if not valid:
             return jsonify({
                 "success": False,
-                "message": f"Could not recognize any device in image. Confidence: {confidence:.2f}"
-            }), 404
+                "message": "Invalid image data"
+            }), 400
         
-        # For visual_target, we use whatever device is recognized
-        # For specific device names, we validate the recognition matches
-        if device_query == "visual_target":
-            target_device = recognized_device
-        else:
-            # Check if recognized device matches the requested device (fuzzy matching)
-            if device_query.lower() not in recognized_device.lower() and recognized_device.lower() not in device_query.lower():
-                return jsonify({
-                    "success": False,
-                    "message": f"Recognized '{recognized_device}' but requested '{device_query}'. Confidence: {confidence:.2f}"
-                }), 400
-            target_device = recognized_device
+        results = [frame_results[i] for i in valid]
+        for device_name, frame_confidence in results:
+            metrics.record_recognition(device_name, frame_confidence)
+        recognized_device, confidence, votes = recognizer.vote(results)
         
-        # Execute command via automation module
-        result = automation_module.execute_command(target_device, action)
+        frames = [{"frame": i, "valid": False} for i in range(len(image_files))]
+        for i, (device_name, frame_confidence) in zip(valid, results):
+            frames[i] = {
+                "frame": i,
+                "valid": True,
+                "recognized_device": device_name,
+                "confidence": frame_confidence
+            }
         
-        # Add recognition info to result
-        result["recognized_device"] = recognized_device
-        result["target_device"] = target_device
-        result["confidence"] = confidence
-        result["requested_device"] = device_query
+        response = {
+            "success": recognized_device is not None,
+            "recognized_device": recognized_device,
+            "confidence": confidence,
+            "votes": votes,
+            "frame_count": len(valid),
+            "frames": frames
+        }
+        status = 200 if recognized_device is not None else 404
         
-        return jsonify(result)
+        if action:
+            result, status = run_command(recognized_device, confidence, device_query, action, breakdown, wants_sync())
+            response.update(result)
+        elif recognized_device is None:
+            response["message"] = f"Could not recognize any device in {len(valid)} frames. Confidence: {confidence:.2f}"
+        
+        if breakdown is not None:
+            response["timing_ms"] = breakdown
+        return jsonify(response), status
+        
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+def recognize_frames(image_datas, breakdown=None):
+    """(device name, confidence) of every frame that decodes, invalid frames are left out"""
+    results = [result for result in recognizer.recognize_uploads(image_datas, lambda stage: metrics.timer(stage, breakdown))
+               if result is not None]
+    for device_name, frame_confidence in results:
+        metrics.record_recognition(device_name, frame_confidence)
+    return results
+
+@app.route('/api/session', methods=['POST'])
+def api_session_start():
+    """API endpoint to open a streaming recognition session, optionally with the first 'images'"""
+    session_id = sessions.create()
+    if request.files.getlist('images'):
+        return api_session_frames(session_id)
+    return jsonify({"success": True, "session": session_id})
+
+@app.route('/api/session/<session_id>/frames', methods=['POST'])
+def api_session_frames(session_id):
+    """API endpoint to add 'images' to a session, they are recognized right away"""
+    breakdown = timing_breakdown()
+    try:
+        if not sessions.exists(session_id):
+            return jsonify({"success": False, "message": "Unknown or expired session"}), 410
+        
+        with metrics.timer("parse", breakdown):
+            image_datas = [upload_bytes(f) for f in request.files.getlist('images') if f.filename != '']
+        
+        if not image_datas:
+            return jsonify({"success": False, "message": "No images uploaded"}), 400
+        
+        results = recognize_frames(image_datas, breakdown)
+        if not sessions.add_results(session_id, results):
+            return jsonify({
+                "success": False,
+                "message": f"Unknown session or more than {config.MAX_SESSION_FRAMES} frames"
+            }), 400
+        
+        response = {
+            "success": True,
+            "session": session_id,
+            "frames": [{"recognized_device": device_name, "confidence": frame_confidence}
+                       for device_name, frame_confidence in results],
+            "invalid_frames": len(image_datas) - len(results)
+        }
+        if breakdown is not None:
+            response["timing_ms"] = breakdown
+        return jsonify(response)
         
     except Exception as e:
         return jsonify({
@@ -148,11 +438,116 @@ def process_command():
             "message": f"Server error: {str(e)}"
         }), 500
 
+@app.route('/api/session/<session_id>/action', methods=['POST'])
+def api_session_action(session_id):
+    """API endpoint to finish a session: vote on its frames and execute 'action' on 'device'
+    
+    Frames still in flight may come along as 'images'. The session is closed either
+    way. Answers 410 for unknown or expired sessions, the client then falls back to
+    sending its frames to /api/recognize_batch (404 means no device was recognized).
+    """
+    breakdown = timing_breakdown()
+    try:
+        action_received = time.time()
+        device_query = request.form.get('device', 'visual_target').strip()
+        action = request.form.get('action', '').strip()
+        
+        session = sessions.close(session_id)
+        if session is None:
+            return jsonify({"success": False, "message": "Unknown or expired session"}), 410
+        if not action:
+            return jsonify({"success": False, "message": "Missing action"}), 400
+        
+        results = session["results"]
+        image_datas = [upload_bytes(f) for f in request.files.getlist('images') if f.filename != '']
+        if image_datas:
+            results = results + recognize_frames(image_datas, breakdown)
+        if not results:
+            return jsonify({"success": False, "message": "No valid frames in session"}), 400
+        
+        recognized_device, confidence, votes = recognizer.vote(results)
+        result, status = run_command(recognized_device, confidence, device_query, action, breakdown, wants_sync())
+        result.update({
+            "votes": votes,
+            "frame_count": len(results),
+            # How long recognition had been finished when the action arrived, the latency saved by streaming
+            "recognition_head_start_ms": round((action_received - session["recognized_at"]) * 1000, 1)
+            if session["recognized_at"] is not None else 0.0
+        })
+        if breakdown is not None:
+            result["timing_ms"] = breakdown
+        return jsonify(result), status
+        
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+@app.route('/api/detect', methods=['POST'])
+def api_detect():
+    """API endpoint listing every registered device found in an 'image', with bounding boxes"""
+    breakdown = timing_breakdown()
+    try:
+        image_file = request.files.get('image')
+        if not image_file:
+            return jsonify({"success": False, "message": "No image uploaded"}), 400
+        
+        with metrics.timer("decode", breakdown):
+            image = recognizer.decode_query(upload_bytes(image_file))
+        if image is None:
+            return jsonify({"success": False, "message": "Invalid image data"}), 400
+        
+        with metrics.timer("detect", breakdown):
+            candidates = recognizer.detect_devices(image)
+        
+        response = {
+            "success": len(candidates) > 0,
+            "candidates": candidates,
+            "width": image.shape[1],
+            "height": image.shape[0]
+        }
+        if breakdown is not None:
+            response["timing_ms"] = breakdown
+        return jsonify(response)
+        
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+@app.route('/api/ann_recall', methods=['GET'])
+def api_ann_recall():
+    """API endpoint to measure approximate search recall against the exact scan"""
+    samples = request.args.get('samples', 200, type=int)
+    return jsonify(recognizer.measure_ann_recall(samples=samples))
+
+@app.route('/api/cache_stats', methods=['GET'])
+def api_cache_stats():
+    """API endpoint with hit, miss and eviction counts of the recognition result cache"""
+    return jsonify(recognizer.result_cache.summary())
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint with per-stage latency histograms and counters"""
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
 @app.route('/device_images/<device_name>/<filename>')
 def device_images(device_name, filename):
     """Serve device images"""
     device_dir = os.path.join(config.DEVICE_PHOTOS_DIR, device_name)
-    return send_from_directory(device_dir, filename)
+    # ETag / Last-Modified revalidation, and long-lived caching of versioned (?v=) URLs
+    return send_from_directory(device_dir, filename, max_age=config.IMAGE_CACHE_MAX_AGE if request.args.get('v') else None)
+
+@app.route('/device_thumbnails/<device_name>/<filename>')
+def device_thumbnails(device_name, filename):
+    """Serve the gallery thumbnail of a device image"""
+    thumbnail_path = recognizer.thumbnail(device_name, filename)
+    if thumbnail_path is None:
+        return "Not found", 404
+    return send_file(os.path.abspath(thumbnail_path), mimetype='image/jpeg',
+                     max_age=config.IMAGE_CACHE_MAX_AGE if request.args.get('v') else None)
 
 @app.route('/api/devices', methods=['GET'])
 def api_get_devices():
@@ -163,12 +558,13 @@ def api_get_devices():
 @app.route('/edit_device/<device_name>')
 def edit_device(device_name):
     """Edit device page"""
-    device_details = recognizer.get_device_details(device_name)
+    page = request.args.get('page', 1, type=int)
+    device_details = recognizer.get_device_details(device_name, page, config.GALLERY_PAGE_SIZE)
     if not device_details:
         flash(f'Device "{device_name}" not found', 'error')
         return redirect(url_for('index'))
     
-    return render_template('edit_device.html', device=device_details)
+    return render_template('edit_device.html', device=device_details, job_id=request.args.get('job'))
 
 @app.route('/update_device_name/<device_name>', methods=['POST'])
 def update_device_name(device_name):
@@ -205,35 +601,47 @@ def add_device_images(device_name):
         flash('No images selected', 'error')
         return redirect(url_for('edit_device', device_name=device_name))
     
-    # Convert to PIL Images
-    pil_images = []
-    for img_file in images:
-        if img_file.filename != '':
-            try:
-                pil_img = Image.open(img_file.stream)
-                pil_images.append(pil_img)
-            except Exception as e:
-                flash(f'Error processing image {img_file.filename}: {e}', 'error')
-                return redirect(url_for('edit_device', device_name=device_name))
-    
-    if len(pil_images) == 0:
+    # Read raw upload bytes, decoding happens in the recognizer's worker pool
+    uploads = [img_file.read() for img_file in images if img_file.filename != '']
+    
+    if len(uploads) == 0:
         flash('No valid images uploaded', 'error')
         return redirect(url_for('edit_device', device_name=device_name))
     
+    # Large uploads are processed in the background so the web UI stays responsive
+    if len(uploads) > config.BACKGROUND_UPLOAD_THRESHOLD:
+        job_id = jobs.submit(f'Adding {len(uploads)} images to "{device_name}"',
+                             recognizer.add_device_images, device_name, uploads)
+        flash(f'Processing {len(uploads)} new images in the background', 'success')
+        return redirect(url_for('edit_device', device_name=device_name, job=job_id))
+    
     # Add images
-    if recognizer.add_device_images(device_name, pil_images):
-        flash(f'Added {len(pil_images)} new images to "{device_name}"', 'success')
-    else:
-        flash('Failed to add images', 'error')
+    try:
+        if recognizer.add_device_images(device_name, uploads):
+            flash(f'Added {len(uploads)} new images to "{device_name}"', 'success')
+        else:
+            flash('Failed to add images', 'error')
+    except Exception as e:
+        flash(f'Error adding images: {e}', 'error')
     
     return redirect(url_for('edit_device', device_name=device_name))
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job_status(job_id):
+    """API endpoint to poll the state of a background job"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Unknown job"}), 404
+    return jsonify(job)
+
 if __name__ == '__main__':
     # Create necessary directories
     os.makedirs(config.DEVICE_PHOTOS_DIR, exist_ok=True)
+    os.makedirs(config.DEVICE_THUMBNAILS_DIR, exist_ok=True)
     
     print("VisualAssistant Server Starting...")
     print(f"Web UI will be available at: http://localhost:{config.PORT}")
     print(f"Home automation module: {config.DEFAULT_MODULE}")
     
+    start_reindex()
     app.run(host=config.HOST, port=config.PORT, debug=config.DEBUG)
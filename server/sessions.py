@@ -0,0 +1,63 @@
+import threading
+import time
+import uuid
+
+
+class SessionManager:
+    """Short-lived streaming recognition sessions
+
+    A client opens a session when the wake word fires and uploads frames while
+    the command is still being spoken; each frame is recognized on arrival and
+    its result kept here until the action arrives. Sessions are held in process
+    memory, clients keep one keep-alive connection (and so one server worker)
+    per session and fall back to /api/recognize_batch if a session is unknown.
+    """
+
+    def __init__(self, ttl=30, max_frames=32):
+        self.ttl = ttl
+        self.max_frames = max_frames
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self):
+        """Open a session and return its id"""
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            self._sessions[session_id] = {
+                "id": session_id,
+                "created": now,
+                "updated": now,
+                "results": [],      # (device name or None, confidence) per recognized frame
+                "recognized_at": None
+            }
+        return session_id
+
+    def _prune(self, now):
+        """Forget sessions idle for longer than ttl (lock held)"""
+        for session_id in [session_id for session_id, session in self._sessions.items()
+                           if now - session["updated"] > self.ttl]:
+            del self._sessions[session_id]
+
+    def add_results(self, session_id, results):
+        """Record per-frame recognition results, returns False for unknown or full sessions"""
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or len(session["results"]) + len(results) > self.max_frames:
+                return False
+            session["results"].extend(results)
+            session["updated"] = now
+            session["recognized_at"] = now
+            return True
+
+    def exists(self, session_id):
+        with self._lock:
+            return session_id in self._sessions
+
+    def close(self, session_id):
+        """Remove a session and return its state, None if unknown or expired"""
+        with self._lock:
+            self._prune(time.time())
+            return self._sessions.pop(session_id, None)
@@ -0,0 +1,18 @@
+"""
+WSGI entry point for production serving with several worker processes
+
+    cd server && gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn.conf.py pre-loads this module in the master process, so the device catalog
+and feature index are built once and shared copy-on-write by the forked workers.
+Each worker catches up with edits made through the others by replaying the tail
+of the devices journal (see DeviceRecognizer.refresh).
+"""
+
+from server import app, recognizer
+
+# A background thread would not survive the fork, so re-index before the workers start
+if recognizer.needs_reindex():
+    print("Stored vectors were produced by another feature extractor, re-indexing before starting workers...")
+    recognizer.reindex()
+